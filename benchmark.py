@@ -0,0 +1,178 @@
+"""
+Benchmark harness driving Freejourney and AsyncFreejourney at a configurable concurrency, against the bundled
+mock server (started in-process by default) or any other server given with --url.
+Reports requests per second, p50/p95/p99 latency and peak RSS.
+Each client runs in a fresh subprocess, so that its peak RSS includes neither the other client nor the mock server.
+The in-process mock server still shares the machine with the client under test, which is fine for comparing runs;
+start `python mock_server.py` elsewhere and pass --url for absolute numbers.
+
+Usage example:
+    python benchmark.py --client both --endpoint create_qr_code --requests 5000 --concurrency 64 --latency 0.01
+    python benchmark.py --endpoint remove_background --image-size 4000000 --requests 200 --json
+    python benchmark.py --client sync --endpoint remove_background --cassette tests/api.cassette
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+from cassette import CassetteAdapter
+from index import ENDPOINTS, AsyncFreejourney, Freejourney
+from mock_server import MockConfig, MockServer
+
+def percentile(latencies, fraction):
+    """
+    Returns the given percentile of a sorted list of latencies, using the nearest-rank method.
+    """
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, max(0, int(round(fraction * len(latencies))) - 1))]
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process, in bytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def default_args(endpoint):
+    """
+    Builds plausible arguments for an endpoint method from its declaration.
+    """
+    return [4 if argument == 'number' else 'steve_harrington' if argument == 'model' else 'benchmark'
+            for argument, _ in endpoint.fields if argument != 'fill']
+
+def report(client, endpoint, requests, errors, duration, latencies):
+    latencies.sort()
+    return {
+        'client': client,
+        'endpoint': endpoint,
+        'requests': requests,
+        'errors': errors,
+        'duration': duration,
+        'requests_per_second': requests / duration if duration else None,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'peak_rss': peak_rss(),
+    }
+
+def run_sync(url, endpoint, args, requests, concurrency, transport=None):
+    latencies = []
+    errors = 0
+    with Freejourney("benchmark", base_url=url, pool_maxsize=concurrency, transport=transport) as freejourney:
+        method = getattr(freejourney, endpoint)
+
+        def call(_):
+            started = time.perf_counter()
+            try:
+                method(*args)
+            except Exception:
+                return None
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency in executor.map(call, range(requests)):
+                if latency is None:
+                    errors += 1
+                else:
+                    latencies.append(latency)
+        duration = time.perf_counter() - started
+    return report('sync', endpoint, requests, errors, duration, latencies)
+
+async def run_async(url, endpoint, args, requests, concurrency):
+    latencies = []
+    errors = 0
+    async with AsyncFreejourney("benchmark", base_url=url, max_concurrency=concurrency,
+                                pool_maxsize=concurrency) as freejourney:
+        method = getattr(freejourney, endpoint)
+        remaining = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    await method(*args)
+                except Exception:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+    return report('async', endpoint, requests, errors, duration, latencies)
+
+def run_client(client, url, endpoint, args, requests, concurrency, cassette=None):
+    """
+    Benchmarks one client. Meant to run in its own subprocess, as ru_maxrss covers the whole life of a process.
+    :param cassette: The cassette to replay responses from, for the sync client.
+    :return: The report of the run.
+    """
+    if client == 'sync':
+        transport = CassetteAdapter(cassette) if cassette else None
+        return run_sync(url, endpoint, args, requests, concurrency, transport)
+    return asyncio.run(run_async(url, endpoint, args, requests, concurrency))
+
+def format_report(result):
+    def ms(value):
+        return f"{value * 1000:.2f} ms" if value is not None else "n/a"
+    return (f"{result['client']:>5} {result['endpoint']}: {result['requests']} requests, {result['errors']} errors, "
+            f"{result['requests_per_second']:.1f} req/s, p50 {ms(result['p50'])}, p95 {ms(result['p95'])}, "
+            f"p99 {ms(result['p99'])}, peak RSS {result['peak_rss'] / 1024 / 1024:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Freejourney clients.")
+    parser.add_argument('--client', choices=('sync', 'async', 'both'), default='both')
+    parser.add_argument('--endpoint', default='dad_joke', choices=sorted(ENDPOINTS),
+                        help="The client method to call.")
+    parser.add_argument('--args', type=json.loads, default=None,
+                        help="JSON list of arguments for the method; plausible defaults are used otherwise.")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--url', default=None, help="Benchmark this server instead of the in-process mock server.")
+    parser.add_argument('--cassette', default=None,
+                        help="Replay the responses recorded in this cassette instead of querying a server, to measure "
+                             "the overhead of the sync client alone.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Mock server latency, in seconds.")
+    parser.add_argument('--image-size', type=int, default=4096, help="Mock server decoded image size, in bytes.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Mock server HTTP 500 probability.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Mock server HTTP 429 probability.")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON lines.")
+    args = parser.parse_args()
+    if args.cassette and args.client != 'sync':
+        parser.error("--cassette requires --client sync")
+
+    server = None
+    url = args.url
+    if url is None and args.cassette is None:
+        config = MockConfig(latency=args.latency, image_size=args.image_size, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, retry_after=0)
+        server = MockServer(('127.0.0.1', 0), config).start()
+        url = server.url
+    call_args = args.args if args.args is not None else default_args(ENDPOINTS[args.endpoint])
+
+    results = []
+    clients = ('sync', 'async') if args.client == 'both' else (args.client,)
+    # A spawned interpreter starts from a clean slate, whereas a forked one would inherit the memory of this one.
+    context = multiprocessing.get_context('spawn')
+    try:
+        for client in clients:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(run_client, client, url, args.endpoint, call_args, args.requests,
+                                               args.concurrency, args.cassette).result())
+    finally:
+        if server is not None:
+            server.stop()
+    for result in results:
+        print(json.dumps(result) if args.json else format_report(result))
+
+if __name__ == '__main__':
+    main()
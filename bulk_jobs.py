@@ -0,0 +1,229 @@
+"""
+Resumable bulk runner for Freejourney endpoints, e.g. to generate tens of thousands of memes or QR codes overnight.
+Jobs are read from a JSONL or CSV file, executed with bounded parallelism, their images decoded straight to an output
+directory, and their completion checkpointed in a SQLite journal so that a restarted run skips finished jobs.
+
+Input formats:
+    JSONL: {"id": "optional-id", "endpoint": "create_qr_code", "args": ["https://www.youtube.com/"]}
+           {"endpoint": "create_did_you_mean_meme", "args": {"text": "Banana", "text_bottom": "Bandana"}}
+    CSV:   endpoint,id,text
+           create_facts_meme,fact-1,Did you know?
+Jobs without an id are identified by their line number, so the input file must not be reordered between runs.
+Ids also name the output files, so jobs whose id is a path, e.g. 'a/b' or '../b', fail without being sent.
+
+Usage example:
+    python bulk_jobs.py jobs.jsonl --token <your_token_here> --output ./images --concurrency 16
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+
+from index import ENDPOINTS, Freejourney, Image, Result
+
+EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+def read_jobs(path):
+    """
+    Reads jobs from a JSONL or CSV file.
+    :param path: The input file; files ending in .csv are read as CSV, anything else as JSONL.
+    :return: A generator of (id, endpoint, args) tuples, args being a list or a dictionary.
+    """
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                endpoint = row.pop('endpoint')
+                job_id = row.pop('id', None) or str(line)
+                yield job_id, endpoint, {key: value for key, value in row.items() if value != ''}
+        else:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                job = json.loads(text)
+                yield str(job.get('id') or line), job['endpoint'], job.get('args', [])
+
+class Journal:
+    """
+    SQLite checkpoint of the jobs of a bulk run. Only use it from the thread that created it.
+    """
+    def __init__(self, path):
+        """
+        Creates an instance of Journal.
+        :param path: The SQLite database file; it is created if missing.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                                "outputs TEXT, error TEXT, finished REAL)")
+        self.connection.commit()
+
+    def done(self):
+        """
+        :return: The set of ids of the jobs completed successfully.
+        """
+        return {row[0] for row in self.connection.execute("SELECT id FROM jobs WHERE status = 'done'")}
+
+    def record(self, job_id, outputs=None, error=None):
+        """
+        Records the outcome of a job; it is committed immediately.
+        :param outputs: The files written by the job, if it succeeded.
+        :param error: The error message, if it failed.
+        """
+        self.connection.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                                (job_id, 'failed' if error is not None else 'done',
+                                 json.dumps(outputs) if outputs is not None else None, error, time.time()))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+class BulkJobRunner:
+    """
+    Runs jobs against a Freejourney client with bounded parallelism, writing their results to a directory.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", image_results=True, pool_maxsize=16)
+    runner = BulkJobRunner(freejourney, "./images", journal="./images/journal.sqlite3", concurrency=16)
+    summary = runner.run(read_jobs("jobs.jsonl"))
+
+    print(summary)
+    # Output: {'done': 9998, 'failed': 2, 'skipped': 0}
+    """
+    def __init__(self, client, output, journal=None, concurrency=8, progress=None):
+        """
+        Creates an instance of BulkJobRunner.
+        :param client: The Freejourney instance to send requests with; it should be created with image_results=True.
+        :param output: The directory to write results to; it is created if missing.
+        :param journal: The SQLite journal file; defaults to journal.sqlite3 in the output directory.
+        :param concurrency: The maximum number of jobs in flight at once.
+        :param progress: A callable receiving (job_id, error) after each job, error being None on success.
+        """
+        self.client = client
+        self.output = output
+        os.makedirs(output, exist_ok=True)
+        self.journal_path = journal or os.path.join(output, 'journal.sqlite3')
+        self.concurrency = concurrency
+        self.progress = progress
+
+    def _write(self, path, write):
+        # Write to a temporary file first so that an interrupted run never leaves a truncated result behind.
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            write(f)
+        os.replace(temporary, path)
+
+    def _path(self, name):
+        """
+        :return: The path of an output file, which has to lie directly in the output directory.
+        :raises ValueError: If the name, built from a job id, points elsewhere, e.g. with '/' or '..'.
+        """
+        path = os.path.join(self.output, name)
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.output):
+            raise ValueError(f"Job ids have to be valid file names, not paths: {name}")
+        return path
+
+    def _save(self, job_id, result):
+        """
+        Writes the images of a result as files, or the whole result as JSON if it has none.
+        :return: The names of the files written.
+        """
+        if isinstance(result, Result):
+            result = result.to_dict()
+        images = []
+        if isinstance(result, dict):
+            value = result.get('base64')
+            images = [value] if isinstance(value, Image) else [item for item in value or () if isinstance(item, Image)]
+        if not images:
+            name = f"{job_id}.json"
+            self._write(self._path(name), lambda f: f.write(json.dumps(result).encode()))
+            return [name]
+        outputs = []
+        for index, image in enumerate(images):
+            suffix = f"_{index}" if len(images) > 1 else ''
+            name = f"{job_id}{suffix}.{EXTENSIONS.get(image.mime_type, 'png')}"
+            self._write(self._path(name), image.write_to)
+            outputs.append(name)
+        return outputs
+
+    def _execute(self, job_id, endpoint, args):
+        method = getattr(self.client, endpoint)
+        result = method(**args) if isinstance(args, dict) else method(*args)
+        return self._save(job_id, result)
+
+    def run(self, jobs):
+        """
+        Runs every job not already completed according to the journal.
+        :param jobs: An iterable of (id, endpoint, args) tuples, such as returned by read_jobs.
+        :return: A dictionary counting the jobs done, failed and skipped.
+        """
+        journal = Journal(self.journal_path)
+        done = journal.done()
+        summary = {'done': 0, 'failed': 0, 'skipped': 0}
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                pending = {}
+                for job_id, endpoint, args in jobs:
+                    if job_id in done:
+                        summary['skipped'] += 1
+                        continue
+                    if endpoint not in ENDPOINTS:
+                        self._finish(journal, summary, job_id, None, f"Unknown endpoint: {endpoint}")
+                        continue
+                    try:
+                        # Fail an unusable id before its request rather than after.
+                        self._path(f"{job_id}.json")
+                    except ValueError as err:
+                        self._finish(journal, summary, job_id, None, str(err))
+                        continue
+                    pending[executor.submit(self._execute, job_id, endpoint, args)] = job_id
+                    while len(pending) >= self.concurrency * 2:
+                        self._collect(journal, summary, pending)
+                while pending:
+                    self._collect(journal, summary, pending)
+        finally:
+            journal.close()
+        return summary
+
+    def _collect(self, journal, summary, pending):
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            job_id = pending.pop(future)
+            error = future.exception()
+            self._finish(journal, summary, job_id, None if error else future.result(),
+                         str(error) if error else None)
+
+    def _finish(self, journal, summary, job_id, outputs, error):
+        journal.record(job_id, outputs, error)
+        summary['failed' if error is not None else 'done'] += 1
+        if self.progress is not None:
+            self.progress(job_id, error)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Freejourney jobs in bulk, resuming where a previous run stopped.")
+    parser.add_argument('input', help="JSONL or CSV file of jobs.")
+    parser.add_argument('--token', default=os.environ.get('FREEJOURNEY_TOKEN'),
+                        help="API key; defaults to the FREEJOURNEY_TOKEN environment variable.")
+    parser.add_argument('--output', default='./output', help="Directory to write the results to.")
+    parser.add_argument('--journal', default=None, help="SQLite journal file; defaults to one in the output directory.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--base-url', default=None)
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("an API key is required (--token or FREEJOURNEY_TOKEN)")
+
+    def progress(job_id, error):
+        if error is not None:
+            print(f"{job_id}: failed: {error}")
+
+    with Freejourney(args.token, pool_maxsize=args.concurrency, image_results=True,
+                     base_url=args.base_url) as freejourney:
+        runner = BulkJobRunner(freejourney, args.output, journal=args.journal, concurrency=args.concurrency,
+                               progress=progress)
+        print(runner.run(read_jobs(args.input)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Record/replay transport for Freejourney, to run tests and benchmarks offline, deterministically and fast.
+In record mode, requests go to the real API (or any server) and every request/response pair is captured into a
+cassette file; in replay mode, responses are served from the memory-mapped cassette without any network access.
+
+Requests are matched on their method, URL path and JSON body, independently of the base URL, the token and the
+compression of the body. Identical requests recorded several times, e.g. to the random content endpoints, are
+replayed in the order they were recorded, the last one being repeated once the others are used up.
+
+Cassette layout: a header, the records (status, JSON headers and body of each response), an index of
+(key, offset) entries sorted by key and searched in place, and a footer pointing at the index.
+
+Usage example:
+    freejourney = Freejourney("<your_token_here>", transport=CassetteAdapter("tests/api.cassette", mode='record'))
+    freejourney.create_qr_code("https://www.youtube.com/")
+    freejourney.close()  # Writes the index of the cassette.
+
+    freejourney = Freejourney("test", transport=CassetteAdapter("tests/api.cassette"))
+    freejourney.create_qr_code("https://www.youtube.com/")  # Served from the cassette.
+
+    python cassette.py tests/api.cassette
+"""
+from urllib.parse import urlsplit
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'FJCASSETTE1\n'
+RECORD = struct.Struct('>HII')
+ENTRY = struct.Struct('>32sQ')
+FOOTER = struct.Struct('>QQ')
+
+# Response headers describing the transfer rather than the response; bodies are stored decoded.
+HOP_HEADERS = frozenset(['connection', 'content-encoding', 'content-length', 'date', 'keep-alive',
+                         'transfer-encoding', 'set-cookie'])
+
+def request_identity(method, url, body, headers):
+    """
+    Builds what identifies a request: its method, URL path and JSON body, canonicalized.
+    :param body: The request body, compressed or not, as sent.
+    :param headers: The request headers, read for Content-Encoding.
+    :return: The identity, as bytes.
+    """
+    parts = urlsplit(url)
+    if isinstance(body, str):
+        body = body.encode()
+    encoding = headers.get('Content-Encoding')
+    if body and encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif body and encoding == 'zstd':
+        if zstandard is None:
+            raise ImportError("Matching zstd request bodies requires the 'zstandard' package.")
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if body:
+        try:
+            # Serializers differ in spacing and key order; the content is what identifies a request.
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+        except ValueError:
+            pass
+    target = parts.path + ('?' + parts.query if parts.query else '')
+    return b'%s %s\n%s' % (method.encode(), target.encode(), body or b'')
+
+def request_key(identity, occurrence):
+    """
+    :param occurrence: The number of identical requests recorded before this one.
+    :return: The key a request is recorded under, a SHA-256 digest.
+    """
+    return hashlib.sha256(b'%s\n%d' % (identity, occurrence)).digest()
+
+class Cassette:
+    """
+    Read-only view of a cassette file, memory-mapped so that opening it costs nothing whatever its size.
+    """
+    def __init__(self, path):
+        """
+        Opens a cassette.
+        :raises ValueError: If the file is not a complete cassette, e.g. because its recording was never closed.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer = len(self._map) - FOOTER.size - len(MAGIC)
+        if self._map[:len(MAGIC)] != MAGIC or footer < len(MAGIC) or self._map[footer + FOOTER.size:] != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a complete cassette: {path}")
+        self._index, self.count = FOOTER.unpack_from(self._map, footer)
+
+    def _key(self, position):
+        start = self._index + position * ENTRY.size
+        return self._map[start:start + 32]
+
+    def find(self, key):
+        """
+        Binary searches the index for a key.
+        :return: The offset of its record, or None if it was not recorded.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(low) == key:
+            return ENTRY.unpack_from(self._map, self._index + low * ENTRY.size)[1]
+        return None
+
+    def read(self, offset):
+        """
+        :return: The status, headers and body of the record at an offset, the body being copied out of the map.
+        """
+        status, headers_size, body_size = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size
+        headers = json.loads(self._map[start:start + headers_size])
+        start += headers_size
+        return status, headers, self._map[start:start + body_size]
+
+    def records(self):
+        """
+        :return: A generator of (key, status, headers, body) tuples, in key order.
+        """
+        for position in range(self.count):
+            key, offset = ENTRY.unpack_from(self._map, self._index + position * ENTRY.size)
+            yield (key, *self.read(offset))
+
+    def close(self):
+        self._map.close()
+
+class CassetteAdapter(BaseAdapter):
+    """
+    requests transport adapter recording responses into a cassette, or replaying them from it.
+    Give it to Freejourney as transport; close the client, or the adapter, to write the index of a recording.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("test", transport=CassetteAdapter("tests/api.cassette"))
+
+    print(freejourney.dad_joke())
+    # Output: {'joke': "No matter how kind you are, German children are kinder."}
+    """
+    def __init__(self, path, mode='replay', adapter=None):
+        """
+        Creates an instance of CassetteAdapter.
+        :param path: The cassette file; recording overwrites it.
+        :param mode: 'replay' to serve recorded responses, or 'record' to send requests and record their responses.
+        :param adapter: The adapter recorded requests are sent through; defaults to an HTTPAdapter.
+        """
+        super().__init__()
+        if mode not in ('replay', 'record'):
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.adapter = adapter
+        self._occurrences = {}
+        self._lock = threading.Lock()
+        self._cassette = None
+        self._file = None
+        self._entries = []
+        self._end = None
+        if mode == 'record':
+            self.adapter = adapter if adapter is not None else HTTPAdapter()
+            self._file = open(path, 'w+b')
+            self._file.write(MAGIC)
+            self._end = self._file.tell()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        identity = request_identity(request.method, request.url, request.body, request.headers)
+        with self._lock:
+            occurrence = self._occurrences.get(identity, 0)
+            self._occurrences[identity] = occurrence + 1
+        key = request_key(identity, occurrence)
+        if self.mode == 'record':
+            response = self.adapter.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                         proxies=proxies)
+            self._record(key, response)
+            return response
+        # Under the lock, as closing the session, e.g. after idle_timeout, closes the cassette too.
+        with self._lock:
+            if self._cassette is None:
+                self._cassette = Cassette(self.path)
+            offset = self._cassette.find(key)
+            if offset is None and occurrence:
+                offset = self._last(self._cassette, identity)
+            record = self._cassette.read(offset) if offset is not None else None
+        if record is None:
+            raise requests.exceptions.ConnectionError(
+                f"No response recorded in {self.path} for {request.method} {request.url}", request=request)
+        return self._build_response(request, *record)
+
+    @staticmethod
+    def _last(cassette, identity):
+        """
+        Finds the last recorded occurrence of a request whose recorded occurrences are used up.
+        :return: The offset of its record, or None if it was never recorded.
+        """
+        offset = None
+        occurrence = 0
+        while True:
+            following = cassette.find(request_key(identity, occurrence))
+            if following is None:
+                return offset
+            offset = following
+            occurrence += 1
+
+    def _record(self, key, response):
+        content = response.content
+        headers = {header: value for header, value in response.headers.items()
+                   if header.lower() not in HOP_HEADERS}
+        encoded = json.dumps(headers).encode()
+        with self._lock:
+            self._file.seek(self._end)
+            self._file.write(RECORD.pack(response.status_code, len(encoded), len(content)))
+            self._file.write(encoded)
+            self._file.write(content)
+            self._entries.append((key, self._end))
+            self._end = self._file.tell()
+
+    @staticmethod
+    def _build_response(request, status, headers, body):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = body
+        response._content_consumed = True
+        # The raw stream stands for the wire, its position being the number of bytes received.
+        response.raw = io.BytesIO(response._content)
+        response.raw.seek(0, os.SEEK_END)
+        response.reason = 'Replayed'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        """
+        Writes the index of a recording, or releases the memory map of a replayed cassette. The adapter may still
+        be used afterwards: a recording then goes on, and is indexed again at the next close().
+        """
+        with self._lock:
+            if self.mode == 'record':
+                self.adapter.close()
+                self._file.seek(self._end)
+                for key, offset in sorted(self._entries):
+                    self._file.write(ENTRY.pack(key, offset))
+                self._file.write(FOOTER.pack(self._end, len(self._entries)) + MAGIC)
+                self._file.truncate()
+                self._file.flush()
+            elif self._cassette is not None:
+                self._cassette.close()
+                self._cassette = None
+
+def main():
+    parser = argparse.ArgumentParser(description="List the responses recorded in a cassette.")
+    parser.add_argument('cassette')
+    args = parser.parse_args()
+    cassette = Cassette(args.cassette)
+    try:
+        print(f"{cassette.count} responses")
+        for key, status, headers, body in cassette.records():
+            print(f"{key.hex()[:16]} {status} {headers.get('Content-Type', '')} {len(body)} bytes")
+    finally:
+        cassette.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,2221 @@
 import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import asyncio
+import binascii
+import bisect
+import contextlib
+import copy
+import email.utils
+import functools
+import gzip
+import hashlib
+import heapq
+import inspect
 import json
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BatchResult = namedtuple('BatchResult', ['index', 'prompt', 'model', 'result', 'error'])
+BatchResult.__doc__ = """
+One item of a batch_chat run.
+:param index: The position of the item in the batch (prompts x models, prompt-major).
+:param prompt: The prompt that was sent.
+:param model: The model the prompt was sent to.
+:param result: The completion dictionary, or None if the request failed.
+:param error: The exception raised by the request, or None if it succeeded.
+"""
+
+CHAT_MODELS = ('chat_gpt4', 'chat_gpt4_34k', 'chat_gpt3_5_turbo', 'chat_gpt3_5_turbo_16k', 'gemini')
+
+# Methods returning random content, which can be fetched ahead of time by a Prefetcher.
+RANDOM_ENDPOINTS = ('dad_joke', 'trivia', 'random_fact', 'cat_fact', 'dog_fact')
+
+# Approximate context window of each chat model, in tokens; character models use 'character'.
+CONTEXT_WINDOWS = {
+    'chat_gpt4': 8192,
+    'chat_gpt4_34k': 34000,
+    'chat_gpt3_5_turbo': 4096,
+    'chat_gpt3_5_turbo_16k': 16384,
+    'gemini': 30720,
+    'character': 4096,
+}
+
+# Endpoints whose responses differ between identical calls: the random content ones and the chat completions.
+NEVER_CACHE = frozenset(['DadJoke', 'Trivia', 'RandomFact', 'CatFact', 'DogFact',
+                         'ChatGPT-4', 'ChatGPT-4-34k', 'ChatGPT-3-5-Turbo', 'ChatGPT-3-5-Turbo-16k', 'Gemini',
+                         'Characters'])
+
+# Endpoints whose requests are not safe to repeat: every call spends quota on a new completion.
+NON_IDEMPOTENT = frozenset(['ChatGPT-4', 'ChatGPT-4-34k', 'ChatGPT-3-5-Turbo', 'ChatGPT-3-5-Turbo-16k', 'Gemini',
+                            'Characters'])
+
+# Characters filter_text accepts to replace moderated words with.
+FILL_CHARACTERS = frozenset('_~-=|*')
+
+# Small, fast endpoints for which a hedged second request is cheap.
+HEDGED = frozenset(['DadJoke', 'Trivia', 'RandomFact', 'CatFact', 'DogFact', 'TextFilter'])
+
+Timeout = namedtuple('Timeout', ['connect', 'read', 'total'], defaults=[10, 120, None])
+Timeout.__doc__ = """
+Timeouts applied to requests, in seconds; None disables the corresponding timeout.
+:param connect: The time allowed to establish a connection.
+:param read: The time allowed between two bytes received from the server.
+:param total: The overall deadline of a call, including retries and backoff.
+"""
+
+class FreejourneyError(Exception):
+    """
+    Raised when a request to the API fails.
+    :param status: The HTTP status code of the response, or None if no response was received.
+    :param retry_after: Seconds the server asked to wait before retrying, or None if it did not say.
+    """
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class RateLimitError(FreejourneyError):
+    """
+    Raised when the API answers a request with HTTP 429 Too Many Requests.
+    """
+
+class RetryPolicy:
+    """
+    Retries failed requests with exponential backoff and full jitter.
+    Requests to NON_IDEMPOTENT endpoints are only retried after HTTP 429, since the server did not process them.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", retry=RetryPolicy(attempts=5, backoff=0.25))
+    """
+    def __init__(self, attempts=3, backoff=0.5, max_backoff=10, statuses=(429, 500, 502, 503, 504)):
+        """
+        Creates an instance of RetryPolicy.
+        :param attempts: The maximum number of attempts, including the first one.
+        :param backoff: The base delay in seconds, doubled after each attempt.
+        :param max_backoff: The maximum delay in seconds between two attempts.
+        :param statuses: The HTTP status codes worth retrying; network errors and timeouts are always retried.
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+
+    def delay(self, attempt, error, name):
+        """
+        Returns the number of seconds to wait before the next attempt, or None if the call should not be retried.
+        :param attempt: The number of attempts made so far.
+        :param error: The FreejourneyError raised by the last attempt.
+        :param name: The endpoint name.
+        """
+        if attempt >= self.attempts:
+            return None
+        if name in NON_IDEMPOTENT and error.status != 429:
+            return None
+        if error.status is not None and error.status not in self.statuses:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        return delay
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second with bursts of up to `burst` requests.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", rate_limit=TokenBucket(5, burst=10))
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Creates an instance of TokenBucket.
+        :param rate: The number of tokens added per second.
+        :param burst: The maximum number of tokens the bucket holds; defaults to max(1, rate).
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token from the bucket.
+        :return: The number of seconds to wait before the token may be used.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens go negative when callers queue up; each waits for its own token to refill.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(delay, self._paused_until - now)
+
+    def pause(self, seconds):
+        """
+        Holds back every reservation for the given number of seconds, e.g. after a Retry-After response.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency governor: the number of requests allowed in flight grows by one per window of
+    successful requests and is cut multiplicatively whenever the API throttles a request. Server errors and network
+    failures leave it unchanged.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", adaptive_concurrency=AdaptiveConcurrency(max_limit=64))
+    """
+    SUCCESS = 'success'
+    THROTTLED = 'throttled'
+    ERROR = 'error'
+
+    def __init__(self, max_limit=32, min_limit=1, initial_limit=None, decrease=0.5):
+        """
+        Creates an instance of AdaptiveConcurrency.
+        :param max_limit: The highest number of requests allowed in flight.
+        :param min_limit: The lowest number of requests allowed in flight.
+        :param initial_limit: The starting limit; defaults to max_limit.
+        :param decrease: The factor the limit is multiplied by on throttling.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit if initial_limit is not None else max_limit)
+        self.decrease = decrease
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        """
+        Takes a slot if one is free.
+        :return: Whether a slot was taken.
+        """
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        """
+        Blocks until a slot is free, then takes it.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, outcome=SUCCESS):
+        """
+        Gives a slot back and adjusts the limit.
+        :param outcome: SUCCESS, THROTTLED if the API answered with HTTP 429, or ERROR for server errors and network
+            failures.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == self.THROTTLED:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+            elif outcome == self.SUCCESS:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+PriorityClass = namedtuple('PriorityClass', ['name', 'reserved', 'limit'], defaults=[0, None])
+PriorityClass.__doc__ = """
+A priority class of a PriorityScheduler.
+:param name: The name of the class, e.g. 'interactive'.
+:param reserved: The number of slots only this class and the higher-priority ones may use, so that they find a free
+    connection even while the lower-priority classes are saturated.
+:param limit: The maximum number of requests of this class in flight at once, or None for no limit of its own.
+"""
+
+class _Ticket:
+    __slots__ = ('index', 'wake', 'queued_at', 'waited', 'admitted', 'cancelled')
+
+    def __init__(self, index, wake):
+        self.index = index
+        self.wake = wake
+        self.queued_at = time.perf_counter()
+        self.waited = 0.0
+        self.admitted = False
+        self.cancelled = False
+
+class PriorityScheduler:
+    """
+    Thread-safe scheduler admitting at most `limit` requests in flight, e.g. the number of pooled connections, by
+    priority class. A free slot always goes to the highest-priority class with a waiting request, and the
+    lower-priority classes use whatever capacity the higher ones leave, minus the slots those reserve. Within a
+    class, the requests of the different endpoint groups take turns by weighted fair queuing, so that a burst of one
+    group only delays the others by its share.
+    An instance may be shared by several clients, sync and async, to split one budget between them.
+    :example:
+    # Usage example:
+    scheduler = PriorityScheduler(limit=16, group_weights={'IMAGES': 2})
+    freejourney = Freejourney("<your_token_here>", pool_maxsize=16, scheduler=scheduler)
+    freejourney.filter_text("Hello world!")
+
+    print(scheduler.snapshot()['interactive']['admitted'])
+    # Output: 1
+    """
+    DEFAULT_CLASSES = (PriorityClass('interactive', reserved=4), PriorityClass('bulk'))
+    # Chat completions and text filtering usually answer live users; everything else goes to the last class.
+    DEFAULT_ENDPOINT_CLASSES = {'CHAT_COMPLETION': 'interactive', 'MODERATION': 'interactive'}
+
+    def __init__(self, limit=16, classes=DEFAULT_CLASSES, endpoint_classes=DEFAULT_ENDPOINT_CLASSES,
+                 default_class=None, group_weights=None, bounds=None):
+        """
+        Creates an instance of PriorityScheduler.
+        :param limit: The maximum number of requests in flight at once, across all classes.
+        :param classes: The PriorityClass instances, highest priority first.
+        :param endpoint_classes: Class names keyed by endpoint name or group, e.g. {'Midjourney': 'bulk'}; endpoint
+            names take precedence over groups.
+        :param default_class: The class of the other endpoints; defaults to the last class.
+        :param group_weights: The weighted fair queuing weights keyed by endpoint group, 1 by default. A group of
+            weight 2 gets twice as many slots as a group of weight 1 of the same class when both have requests waiting.
+        :param bounds: The upper bounds of the wait time histogram buckets, in seconds; defaults to
+            Metrics.DEFAULT_BOUNDS.
+        """
+        self.limit = limit
+        self.classes = tuple(classes)
+        self._indexes = {priority_class.name: index for index, priority_class in enumerate(self.classes)}
+        default_class = default_class if default_class is not None else self.classes[-1].name
+        for class_name in (*endpoint_classes.values(), default_class):
+            if class_name not in self._indexes:
+                raise ValueError(f"Unknown priority class: {class_name}")
+        self.endpoint_classes = dict(endpoint_classes)
+        self.default_class = default_class
+        self.group_weights = dict(group_weights or {})
+        # The number of slots each class may fill, leaving the reserves of the higher-priority classes free.
+        self._ceilings = []
+        reserved = 0
+        for priority_class in self.classes:
+            self._ceilings.append(limit - reserved)
+            reserved += priority_class.reserved
+        if self._ceilings[-1] < 1:
+            raise ValueError(f"The priority classes reserve every one of the {limit} slots, leaving none to the last one")
+        self.in_flight = 0
+        self._in_flight = [0] * len(self.classes)
+        self._queues = [[] for _ in self.classes]
+        self._queued = [0] * len(self.classes)
+        self._max_queued = [0] * len(self.classes)
+        self._admitted = [0] * len(self.classes)
+        self._waits = [Histogram(tuple(bounds or Metrics.DEFAULT_BOUNDS)) for _ in self.classes]
+        # Weighted fair queuing state per class: the virtual time and the last finish tag of each group.
+        self._virtual_time = [0.0] * len(self.classes)
+        self._finish_tags = [{} for _ in self.classes]
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def class_of(self, group, name):
+        """
+        :return: The name of the class of an endpoint.
+        """
+        return self.endpoint_classes.get(name) or self.endpoint_classes.get(group) or self.default_class
+
+    def _admissible(self, index):
+        limit = self.classes[index].limit
+        return self.in_flight < self._ceilings[index] and (limit is None or self._in_flight[index] < limit)
+
+    def _admit(self, ticket):
+        ticket.admitted = True
+        ticket.waited = time.perf_counter() - ticket.queued_at
+        self.in_flight += 1
+        self._in_flight[ticket.index] += 1
+        self._admitted[ticket.index] += 1
+        self._waits[ticket.index].observe(ticket.waited)
+
+    def _dispatch(self):
+        """
+        Admits as many queued requests as the slots allow, highest priority first.
+        :return: The tickets admitted, to wake up once the lock is released.
+        """
+        admitted = []
+        for index, queue in enumerate(self._queues):
+            while queue and self._admissible(index):
+                tag, _, ticket = heapq.heappop(queue)
+                if ticket.cancelled:
+                    continue
+                self._virtual_time[index] = tag
+                self._queued[index] -= 1
+                self._admit(ticket)
+                admitted.append(ticket)
+        return admitted
+
+    def _enqueue(self, group, name, wake):
+        """
+        Admits a request right away if a slot is free and nobody of its class is waiting, or queues it.
+        :param wake: The callable to call once a queued request is admitted.
+        :return: The ticket of the request.
+        """
+        index = self._indexes[self.class_of(group, name)]
+        ticket = _Ticket(index, wake)
+        with self._lock:
+            if not self._queued[index] and self._admissible(index):
+                self._admit(ticket)
+                return ticket
+            finish_tags = self._finish_tags[index]
+            tag = max(self._virtual_time[index], finish_tags.get(group, 0.0)) + 1 / self.group_weights.get(group, 1)
+            finish_tags[group] = tag
+            self._sequence += 1
+            heapq.heappush(self._queues[index], (tag, self._sequence, ticket))
+            self._queued[index] += 1
+            self._max_queued[index] = max(self._max_queued[index], self._queued[index])
+        return ticket
+
+    def _cancel(self, ticket):
+        """
+        Withdraws a queued request.
+        :return: False if it was admitted in the meantime, in which case its slot must be used or released.
+        """
+        with self._lock:
+            if ticket.admitted:
+                return False
+            ticket.cancelled = True
+            self._queued[ticket.index] -= 1
+            return True
+
+    def acquire(self, group, name, timeout=None):
+        """
+        Blocks until a request to an endpoint may be sent.
+        :param timeout: The maximum number of seconds to wait, or None to wait as long as needed.
+        :return: The ticket to give back to release(), or None if the timeout expired first.
+        """
+        event = threading.Event()
+        ticket = self._enqueue(group, name, event.set)
+        if ticket.admitted or event.wait(timeout) or not self._cancel(ticket):
+            return ticket
+        return None
+
+    async def acquire_async(self, group, name, timeout=None):
+        """
+        Coroutine version of acquire(), for AsyncFreejourney.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._enqueue(group, name, wake)
+        if ticket.admitted:
+            return ticket
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if self._cancel(ticket):
+                return None
+        except asyncio.CancelledError:
+            if not self._cancel(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        """
+        Gives back the slot of a finished request and admits the next queued ones.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._in_flight[ticket.index] -= 1
+            admitted = self._dispatch()
+        for waiting in admitted:
+            waiting.wake()
+
+    def snapshot(self):
+        """
+        :return: A dictionary keyed by class name of the requests in flight, the requests queued now and at most, the
+            number of requests admitted, and the histogram of their wait times in seconds.
+        """
+        with self._lock:
+            return {priority_class.name: {'in_flight': self._in_flight[index], 'queued': self._queued[index],
+                                          'max_queued': self._max_queued[index], 'admitted': self._admitted[index],
+                                          'wait': self._waits[index].snapshot()}
+                    for index, priority_class in enumerate(self.classes)}
+
+class Backend:
+    """
+    One API key on one base URL, with the statistics a LoadBalancer keeps about it.
+    """
+    def __init__(self, token, base_url):
+        self.token = token
+        self.base_url = base_url
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.consecutive_failures = 0
+        # Exponentially weighted moving average of the request latency, in seconds.
+        self.latency = None
+        self.cooldown_until = 0
+
+    def __repr__(self):
+        return f"<Backend {self.base_url} key ...{self.token[-4:]}, {'healthy' if self.healthy else 'unhealthy'}>"
+
+class LoadBalancer:
+    """
+    Spreads requests over several API keys and base URLs, taking failing backends out of rotation.
+    A backend is every combination of a key and a base URL. It leaves the rotation after max_failures consecutive
+    network errors or HTTP 5xx responses, and rejoins it once a background health probe succeeds; a throttled
+    backend is skipped for as long as its Retry-After asked, and a key is skipped once it has used its quota. A key
+    answered with HTTP 401 or 403 is revoked: all its backends leave the rotation until reinstate() is called, as the
+    health probes send no key and cannot tell.
+    If no backend is available, requests go to all of them rather than failing outright.
+    :example:
+    # Usage example:
+    freejourney = Freejourney(["<key_1>", "<key_2>"], base_url=["https://eu.example.com/", "https://us.example.com/"],
+                              load_balancer=LoadBalancer.LATENCY)
+    print(freejourney.load_balancer.snapshot())
+    """
+    ROUND_ROBIN = 'round_robin'
+    LEAST_OUTSTANDING = 'least_outstanding'
+    LATENCY = 'latency'
+
+    def __init__(self, tokens, base_urls, strategy=ROUND_ROBIN, max_failures=3, probe_interval=30, probe=None,
+                 quota=None, quota_period=86400):
+        """
+        Creates an instance of LoadBalancer.
+        :param tokens: The API keys to use.
+        :param base_urls: The API root URLs to use.
+        :param strategy: ROUND_ROBIN, LEAST_OUTSTANDING (fewest requests in flight), or LATENCY (random choice weighted
+            by the inverse of the average latency).
+        :param max_failures: The number of consecutive failures after which a backend leaves the rotation.
+        :param probe_interval: Seconds between two rounds of health probes, or None to disable them, in which case
+            unhealthy backends never rejoin the rotation.
+        :param probe: A callable receiving a Backend and returning whether it is healthy; by default, a GET request to
+            its base URL answered without an HTTP 5xx status.
+        :param quota: The number of requests each key may send per quota_period, or None for no limit.
+        :param quota_period: The length of a quota period, in seconds.
+        """
+        if strategy not in (self.ROUND_ROBIN, self.LEAST_OUTSTANDING, self.LATENCY):
+            raise ValueError(f"Unknown load balancing strategy: {strategy}")
+        self.backends = [Backend(token, base_url) for base_url in base_urls for token in tokens]
+        if not self.backends:
+            raise ValueError("A LoadBalancer needs at least one token and one base URL")
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.probe = probe or self._probe
+        self.quota = quota
+        self.quota_period = quota_period
+        # Requests sent by each key in the current quota period, and when that period started.
+        self.usage = {token: 0 for token in tokens}
+        # Keys the API rejected as invalid or revoked.
+        self.revoked = set()
+        self._period_start = time.monotonic()
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._prober = None
+        if probe_interval is not None:
+            self._prober = threading.Thread(target=self._probe_loop, name='freejourney-health-probes', daemon=True)
+            self._prober.start()
+
+    def _available(self, now):
+        if self.quota is not None and now - self._period_start >= self.quota_period:
+            self._period_start = now
+            self.usage = dict.fromkeys(self.usage, 0)
+        available = [backend for backend in self.backends if backend.healthy and backend.cooldown_until <= now and
+                     backend.token not in self.revoked and
+                     (self.quota is None or self.usage[backend.token] < self.quota)]
+        return available or self.backends
+
+    def acquire(self):
+        """
+        Picks the backend of the next request; it must be given back with release() once the request completes.
+        """
+        with self._lock:
+            backends = self._available(time.monotonic())
+            self._next += 1
+            if self.strategy == self.ROUND_ROBIN:
+                backend = backends[self._next % len(backends)]
+            elif self.strategy == self.LEAST_OUTSTANDING:
+                # Rotate the starting point so that ties are spread evenly.
+                start = self._next % len(backends)
+                backend = min(backends[start:] + backends[:start], key=lambda candidate: candidate.outstanding)
+            else:
+                known = [backend.latency for backend in backends if backend.latency is not None]
+                # Untried backends are assumed as fast as the fastest one, so that they get measured.
+                fastest = min(known) if known else 1.0
+                weights = [1 / max(backend.latency if backend.latency is not None else fastest, 1e-3)
+                           for backend in backends]
+                backend = random.choices(backends, weights)[0]
+            backend.outstanding += 1
+            backend.requests += 1
+            self.usage[backend.token] = self.usage.get(backend.token, 0) + 1
+            return backend
+
+    def release(self, backend, latency, status=None, retry_after=None):
+        """
+        Records the outcome of a request sent to a backend.
+        :param latency: The duration of the request, in seconds.
+        :param status: The HTTP status of the response, or None if none was received.
+        :param retry_after: The seconds a throttled response asked to wait, if any.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            if status == 429:
+                backend.throttled += 1
+                if retry_after:
+                    backend.cooldown_until = time.monotonic() + retry_after
+            elif status in (401, 403):
+                backend.failures += 1
+                self.revoked.add(backend.token)
+            elif status is None or status >= 500:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.max_failures:
+                    backend.healthy = False
+            else:
+                backend.consecutive_failures = 0
+                backend.latency = latency if backend.latency is None else 0.8 * backend.latency + 0.2 * latency
+
+    def reinstate(self, token):
+        """
+        Puts a revoked key back into the rotation, e.g. once it has been renewed.
+        """
+        with self._lock:
+            self.revoked.discard(token)
+
+    @staticmethod
+    def _probe(backend):
+        try:
+            return requests.get(backend.base_url, timeout=Timeout().connect).status_code < 500
+        except requests.exceptions.RequestException:
+            return False
+
+    def _probe_loop(self):
+        while not self._stopped.wait(self.probe_interval):
+            for backend in list(self.backends):
+                try:
+                    healthy = self.probe(backend)
+                except Exception:
+                    healthy = False
+                with self._lock:
+                    backend.healthy = healthy
+                    if healthy:
+                        backend.consecutive_failures = 0
+
+    def snapshot(self):
+        """
+        :return: The statistics of every backend, as a list of dictionaries.
+        """
+        with self._lock:
+            return [{'base_url': backend.base_url, 'key': f"...{backend.token[-4:]}", 'healthy': backend.healthy,
+                     'outstanding': backend.outstanding, 'requests': backend.requests, 'failures': backend.failures,
+                     'throttled': backend.throttled, 'latency': backend.latency,
+                     'revoked': backend.token in self.revoked, 'quota_used': self.usage.get(backend.token)} for backend in self.backends]
+
+    def close(self):
+        """
+        Stops the health probes.
+        """
+        self._stopped.set()
+
+class Image:
+    """
+    A base64-encoded image returned by the API, decoded on first access.
+    Once decoded, the base64 text is released so that only one copy of the image is held in memory.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", image_results=True)
+    image = freejourney.create_qr_code("https://www.youtube.com/")['base64']
+
+    image.save("qrcode.png")
+    print(image.mime_type, len(image))
+    # Output: image/png 1034
+    """
+    __slots__ = ('_encoded', '_start', '_decoded', 'mime_type')
+
+    # Decoding chunk size, in base64 characters; a multiple of 4 so that chunks decode independently.
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, encoded):
+        """
+        Creates an instance of Image.
+        :param encoded: The base64 text of the image, optionally prefixed with a data: URL header.
+        """
+        self._encoded = encoded
+        self._start = 0
+        self._decoded = None
+        self.mime_type = None
+        if encoded.startswith('data:'):
+            # Remember where the payload starts instead of slicing, which would copy it.
+            self._start = encoded.index(',') + 1
+            self.mime_type = encoded[5:self._start - 1].split(';')[0] or None
+
+    @classmethod
+    def wrap(cls, data):
+        """
+        Replaces the base64 strings of a response's data by Image objects, in place.
+        :param data: The 'data' field of an image endpoint response.
+        :return: The same data.
+        """
+        if isinstance(data, dict):
+            for key, value in data.items():
+                if key == 'base64' and isinstance(value, str):
+                    data[key] = cls(value)
+                elif key == 'base64' and isinstance(value, list):
+                    data[key] = [cls(item) if isinstance(item, str) else cls.wrap(item) for item in value]
+                elif isinstance(value, (dict, list)):
+                    cls.wrap(value)
+        elif isinstance(data, list):
+            for i, value in enumerate(data):
+                if isinstance(value, str) and value.startswith('data:image/'):
+                    data[i] = cls(value)
+                else:
+                    cls.wrap(value)
+        return data
+
+    def _chunks(self):
+        encoded = self._encoded
+        for i in range(self._start, len(encoded), self.CHUNK_SIZE):
+            yield binascii.a2b_base64(encoded[i:i + self.CHUNK_SIZE])
+
+    def _decode(self):
+        if self._decoded is None:
+            encoded = self._encoded
+            size = (len(encoded) - self._start) * 3 // 4 - (len(encoded) - len(encoded.rstrip('=')))
+            decoded = bytearray(size)
+            offset = 0
+            for chunk in self._chunks():
+                decoded[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+            self._decoded = memoryview(decoded)[:offset]
+            self._encoded = None
+        return self._decoded
+
+    @property
+    def data(self):
+        """
+        The decoded image, as a read-only memoryview over the single decoded buffer.
+        """
+        return self._decode().toreadonly()
+
+    def __bytes__(self):
+        return self._decode().tobytes()
+
+    def __len__(self):
+        return len(self._decode())
+
+    def __repr__(self):
+        state = f"{len(self._decoded)} bytes" if self._decoded is not None else "not decoded"
+        return f"<Image {self.mime_type or 'unknown type'}, {state}>"
+
+    @property
+    def base64(self):
+        """
+        The base64 text of the image, without any data: URL header.
+        """
+        if self._decoded is not None:
+            return binascii.b2a_base64(self._decoded, newline=False).decode('ascii')
+        return self._encoded[self._start:]
+
+    def write_to(self, stream):
+        """
+        Writes the decoded image to a binary file-like object or socket, chunk by chunk if it has not been decoded yet.
+        :param stream: An object with a write() or sendall() method accepting bytes.
+        :return: The number of bytes written.
+        """
+        write = stream.sendall if hasattr(stream, 'sendall') else stream.write
+        if self._decoded is not None:
+            write(self._decoded)
+            return len(self._decoded)
+        written = 0
+        for chunk in self._chunks():
+            write(chunk)
+            written += len(chunk)
+        return written
+
+    def save(self, path):
+        """
+        Writes the decoded image to a file.
+        :param path: The path of the file to create or overwrite.
+        :return: The number of bytes written.
+        """
+        with open(path, 'wb') as f:
+            return self.write_to(f)
+
+class ImageStreamParser:
+    """
+    Incremental scanner extracting the images of a JSON response while its bytes arrive.
+    The values of "base64" fields, a string or an array of strings, are decoded chunk by chunk (dropping any
+    data: URL header) and returned as soon as each string is complete; the rest of the document is skipped.
+    :example:
+    # Usage example:
+    parser = ImageStreamParser()
+    for chunk in response.iter_content(chunk_size=65536):
+        for image in parser.feed(chunk):
+            handle(image)
+    parser.close("Midjourney image search")
+    """
+    KEY = b'"base64"'
+    # Start of the document kept to report errors of responses without images.
+    HEAD_SIZE = 64 * 1024
+    # Minimum number of base64 characters decoded at once; a multiple of 4.
+    DECODE_SIZE = 64 * 1024
+    _STRING_END = re.compile(rb'["\\]')
+    _WHITESPACE = b' \t\r\n'
+
+    def __init__(self):
+        self.images = 0
+        self._state = 'key'
+        self._tail = b''
+        self._in_array = False
+        self._escape = False
+        self._header = True
+        self._encoded = bytearray()
+        self._decoded = bytearray()
+        self._head = bytearray()
+
+    def feed(self, chunk):
+        """
+        Processes the next bytes of the response.
+        :return: The list of images completed by these bytes, as bytearrays.
+        """
+        if len(self._head) < self.HEAD_SIZE:
+            self._head += chunk[:self.HEAD_SIZE - len(self._head)]
+        images = []
+        i, size = 0, len(chunk)
+        while i < size:
+            state = self._state
+            if state == 'key':
+                data = self._tail + chunk[i:]
+                position = data.find(self.KEY)
+                if position < 0:
+                    self._tail = data[-(len(self.KEY) - 1):]
+                    break
+                i += position + len(self.KEY) - len(self._tail)
+                self._tail = b''
+                self._state = 'colon'
+            elif chunk[i] in self._WHITESPACE and state != 'string':
+                i += 1
+            elif state == 'colon':
+                self._state = 'value' if chunk[i:i + 1] == b':' else 'key'
+                i += 1
+            elif state == 'value':
+                character = chunk[i:i + 1]
+                if character == b'"':
+                    self._state = 'string'
+                    self._header = True
+                    i += 1
+                elif character == b'[' and not self._in_array:
+                    self._in_array = True
+                    i += 1
+                else:
+                    self._in_array = False
+                    self._state = 'key'
+            elif state == 'separator':
+                # Between the strings of an array.
+                self._state = 'value' if chunk[i:i + 1] == b',' else 'key'
+                self._in_array = self._state == 'value'
+                i += 1
+            elif self._escape:
+                # Base64 only ever needs escaping for "\/".
+                self._escape = False
+                self._append(chunk[i:i + 1])
+                i += 1
+            else:
+                match = self._STRING_END.search(chunk, i)
+                end = match.start() if match else size
+                self._append(chunk[i:end])
+                i = end + 1
+                if match is None:
+                    break
+                if chunk[end:end + 1] == b'\\':
+                    self._escape = True
+                else:
+                    images.append(self._finish())
+                    self._state = 'separator' if self._in_array else 'key'
+        return images
+
+    def _append(self, data):
+        encoded = self._encoded
+        encoded += data
+        if self._header:
+            if len(encoded) < 5 and b'data:'.startswith(bytes(encoded)):
+                return
+            if encoded.startswith(b'data:'):
+                comma = encoded.find(b',')
+                if comma < 0:
+                    return
+                del encoded[:comma + 1]
+            self._header = False
+        usable = len(encoded) - len(encoded) % 4
+        if usable >= self.DECODE_SIZE:
+            self._decoded += binascii.a2b_base64(encoded[:usable])
+            del encoded[:usable]
+
+    def _finish(self):
+        if self._encoded:
+            self._decoded += binascii.a2b_base64(self._encoded)
+        image = self._decoded
+        self._encoded = bytearray()
+        self._decoded = bytearray()
+        self.images += 1
+        return image
+
+    def close(self, label):
+        """
+        Checks the response once it has been fully received.
+        :param label: The name used in error messages.
+        :raises FreejourneyError: If the response had no images and reported a failure.
+        """
+        if self.images or len(self._head) >= self.HEAD_SIZE:
+            return
+        try:
+            data = json.loads(bytes(self._head))
+        except ValueError as err:
+            raise FreejourneyError(f"An error occurred: {err}")
+        if isinstance(data, dict) and not data.get('success'):
+            raise FreejourneyError(f"{label} failed: {data.get('message')}")
+
+class Result:
+    """
+    Base of the compact result objects returned with typed_results=True, whose fields are stored in __slots__
+    instead of a dictionary per result. Fields the API adds later are kept in a dictionary of extras.
+    Results can still be read like the dictionaries they replace, e.g. result['joke'], 'base64' in result or
+    dict(result), and to_dict() rebuilds the original dictionary. Fields missing from the response are stored as None
+    and left out of keys().
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", typed_results=True)
+    trivia = freejourney.trivia()
+
+    print(trivia.correct, trivia.difficulty)
+    # Output: Colombia medium
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Builds a result from the 'data' field of a response.
+        """
+        result = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(result, field, data.get(field))
+        result._extra = {key: value for key, value in data.items() if key not in cls.FIELDS} or None
+        return result
+
+    def to_dict(self):
+        """
+        :return: The result as the dictionary the API returned.
+        """
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self.to_dict()[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        return [key for key, value in self.to_dict().items() if value is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Joke(Result):
+    __slots__ = FIELDS = ('joke',)
+
+class Fact(Result):
+    __slots__ = FIELDS = ('fact',)
+
+class Trivia(Result):
+    """
+    A trivia question, its answers flattened into correct and incorrect; the difficulty is interned.
+    """
+    __slots__ = FIELDS = ('question', 'correct', 'incorrect', 'difficulty')
+
+    @classmethod
+    def from_data(cls, data):
+        answers = data.get('answers') or {}
+        result = super().from_data({key: value for key, value in data.items() if key != 'answers'})
+        result.correct = answers.get('correct')
+        result.incorrect = tuple(answers.get('incorrect') or ())
+        result.difficulty = _intern(result.difficulty)
+        return result
+
+    def to_dict(self):
+        data = {'question': self.question, 'answers': {'correct': self.correct, 'incorrect': list(self.incorrect)},
+                'difficulty': self.difficulty}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+class CharacterModel(Result):
+    """
+    The description of a character model. Identical descriptions share a single instance, as every completion of a
+    character repeats it.
+    """
+    __slots__ = FIELDS = ('model_id', 'name')
+    # Beyond this many distinct descriptions, new ones are no longer interned.
+    MAX_INTERNED = 4096
+    _interned = {}
+
+    @classmethod
+    def from_data(cls, data):
+        try:
+            key = json.dumps(data, sort_keys=True)
+        except (TypeError, ValueError):
+            return super().from_data(data)
+        model = cls._interned.get(key)
+        if model is None:
+            model = super().from_data(data)
+            model.model_id = _intern(model.model_id)
+            if len(cls._interned) < cls.MAX_INTERNED:
+                model = cls._interned.setdefault(key, model)
+        return model
+
+class Completion(Result):
+    """
+    A chat completion; the model of character completions is an interned CharacterModel.
+    """
+    __slots__ = FIELDS = ('prompt', 'completion', 'model')
+
+    @classmethod
+    def from_data(cls, data):
+        result = super().from_data(data)
+        if isinstance(result.model, dict):
+            result.model = CharacterModel.from_data(result.model)
+        return result
+
+    def to_dict(self):
+        data = super().to_dict()
+        if self.model is None:
+            del data['model']
+        elif isinstance(self.model, CharacterModel):
+            data['model'] = self.model.to_dict()
+        return data
+
+class FilteredText(Result):
+    __slots__ = FIELDS = ('text', 'result')
+
+class ImageResult(Result):
+    """
+    The result of an image endpoint: a base64 string, an Image with image_results=True, or a list of them.
+    """
+    __slots__ = FIELDS = ('base64',)
+
+# Result type of each endpoint with typed_results=True, by endpoint name, then by group.
+RESULT_TYPES = {
+    'DadJoke': Joke,
+    'Trivia': Trivia,
+    'RandomFact': Fact,
+    'CatFact': Fact,
+    'DogFact': Fact,
+    'TextFilter': FilteredText,
+    'CHAT_COMPLETION': Completion,
+    'IMAGES': ImageResult,
+}
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """
+        :return: The count and sum of the observations, and the number of observations per bucket keyed by the
+            bucket's upper bound ('+Inf' for the last one).
+        """
+        buckets = dict(zip(self.bounds, self.counts))
+        buckets['+Inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+class Metrics:
+    """
+    Per-endpoint request statistics, keyed by the endpoint names of endpoints.json (e.g. 'ChatGPT-4', 'QRCode').
+
+    Counters: requests, bytes_sent, bytes_received, bytes_saved, retries, cache_hits, coalesced, local_hits, and
+    errors.<status> (errors.network when no response was received). Byte counts are measured on the wire, and
+    bytes_saved counts what request and response compression saved.
+    Latency histograms, in seconds: total, ttfb (time to response headers), queue_wait (time spent waiting for a
+    PriorityScheduler), plus dns and connect (TCP and TLS handshakes) on AsyncFreejourney, whose transport exposes
+    those phases.
+
+    Hooks are called as hook(kind, endpoint, metric, value) for every update, kind being 'counter' or 'histogram',
+    so that exporters can forward them to Prometheus, OpenTelemetry, StatsD...
+    :example:
+    # Usage example:
+    metrics = Metrics()
+    freejourney = Freejourney("<your_token_here>", metrics=metrics)
+    freejourney.dad_joke()
+
+    print(metrics.snapshot()['DadJoke']['counters']['requests'])
+    # Output: 1
+    """
+    DEFAULT_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS, hooks=()):
+        """
+        Creates an instance of Metrics.
+        :param bounds: The upper bounds of the histogram buckets, in seconds, in increasing order.
+        :param hooks: Callables receiving every update.
+        """
+        self.bounds = tuple(bounds)
+        self.hooks = list(hooks)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, endpoint, counter, amount=1):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {})
+            counters[counter] = counters.get(counter, 0) + amount
+        for hook in self.hooks:
+            hook('counter', endpoint, counter, amount)
+
+    def observe(self, endpoint, histogram, seconds):
+        with self._lock:
+            histograms = self._histograms.setdefault(endpoint, {})
+            if histogram not in histograms:
+                histograms[histogram] = Histogram(self.bounds)
+            histograms[histogram].observe(seconds)
+        for hook in self.hooks:
+            hook('histogram', endpoint, histogram, seconds)
+
+    def error(self, endpoint, status):
+        """
+        Counts a failed request.
+        :param status: The HTTP status code of the response, or None if no response was received.
+        """
+        self.increment(endpoint, f"errors.{status if status is not None else 'network'}")
+
+    def snapshot(self):
+        """
+        :return: A dictionary of {'counters': {...}, 'histograms': {...}} keyed by endpoint name.
+        """
+        with self._lock:
+            return {endpoint: {'counters': dict(self._counters.get(endpoint, {})),
+                               'histograms': {name: histogram.snapshot()
+                                              for name, histogram in self._histograms.get(endpoint, {}).items()}}
+                    for endpoint in self._counters.keys() | self._histograms.keys()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+class MemoryCache:
+    """
+    In-memory LRU response cache bounded by the total size of the cached bodies.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", cache=MemoryCache(max_bytes=256 * 1024 * 1024))
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Creates an instance of MemoryCache.
+        :param max_bytes: The maximum total size of the cached response bodies.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached response body for a key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            content, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                self.size -= len(content)
+                return None
+            self._entries.move_to_end(key)
+            return content
+
+    def set(self, key, content, ttl=None):
+        """
+        Caches a response body, evicting the least recently used entries to stay under max_bytes.
+        :param ttl: Seconds the entry stays valid, or None to keep it until evicted.
+        """
+        if len(content) > self.max_bytes:
+            return
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = (content, expires)
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)[1]
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+class SemanticCache:
+    """
+    Completion cache matching near-duplicate prompts, e.g. "How do I reset my password?" and
+    "how can i reset my password", so that they share one chat completion.
+    Prompts are normalized and embedded as hashed character trigrams and words. Candidates come from a
+    locality-sensitive hashing index of random hyperplane signatures, and the closest one within each model's
+    namespace is a hit if its cosine similarity reaches the threshold. Similarity is lexical: prompts asking
+    different questions with mostly the same words can match, so keep the threshold high.
+    :example:
+    # Usage example:
+    cache = SemanticCache(max_entries=50000)
+    freejourney = Freejourney("<your_token_here>", semantic_cache=cache)
+    freejourney.chat_gpt3_5_turbo("How do I reset my password?")
+    freejourney.chat_gpt3_5_turbo("how can I reset my password")  # Served from the cache.
+    print(cache.stats())
+    """
+    def __init__(self, threshold=0.8, max_entries=10000, ttl=None, dimensions=1024, bands=12, bits=10, seed=0):
+        """
+        Creates an instance of SemanticCache.
+        :param threshold: The minimum cosine similarity, between 0 and 1, for a cached completion to be reused.
+        :param max_entries: The maximum number of completions kept; the least recently used ones are evicted.
+        :param ttl: Seconds a completion stays valid, or None to keep it until evicted.
+        :param dimensions: The size of the hashed embeddings.
+        :param bands: The number of LSH tables; more tables find more near-duplicates but check more candidates.
+        :param bits: The signature bits per table; more bits check fewer candidates but find fewer near-duplicates.
+        :param seed: The seed of the random hyperplanes.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dimensions = dimensions
+        self.bands = bands
+        self.bits = bits
+        # Hyperplane j's coordinate on dimension i is +1 if bit j of _planes[i] is set, -1 otherwise.
+        planes = random.Random(seed)
+        self._planes = [planes.getrandbits(bands * bits) for _ in range(dimensions)]
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(prompt):
+        """
+        Lowercases a prompt, strips accents and punctuation, and collapses whitespace.
+        """
+        text = unicodedata.normalize('NFKD', prompt.casefold())
+        text = ''.join(character if character.isalnum() else ' ' for character in text
+                       if not unicodedata.combining(character))
+        return ' '.join(text.split())
+
+    def embed(self, prompt):
+        """
+        :return: The normalized sparse embedding of a prompt, as a dictionary of dimension to weight.
+        """
+        text = f" {self.normalize(prompt)} "
+        features = [text[i:i + 3] for i in range(len(text) - 2)] + text.split()
+        vector = {}
+        for feature in features:
+            hashed = zlib.crc32(feature.encode())
+            index = hashed % self.dimensions
+            # The sign spreads colliding features so that they cancel out instead of adding up.
+            vector[index] = vector.get(index, 0.0) + (1.0 if hashed & 0x80000000 else -1.0)
+        norm = sum(weight * weight for weight in vector.values()) ** 0.5
+        return {index: weight / norm for index, weight in vector.items() if weight} if norm else {}
+
+    def _signature(self, namespace, vector):
+        """
+        :return: The LSH bucket keys of a vector, one per band.
+        """
+        planes = self._planes
+        sums = [0.0] * (self.bands * self.bits)
+        for index, weight in vector.items():
+            plane = planes[index]
+            for j in range(len(sums)):
+                sums[j] += weight if plane >> j & 1 else -weight
+        keys = []
+        for band in range(self.bands):
+            value = 0
+            for total in sums[band * self.bits:(band + 1) * self.bits]:
+                value = value << 1 | (total > 0)
+            keys.append((namespace, band, value))
+        return keys
+
+    @staticmethod
+    def _similarity(a, b):
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(weight * b.get(index, 0.0) for index, weight in a.items())
+
+    def _remove(self, entry_id):
+        keys = self._entries.pop(entry_id)[1]
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def get(self, namespace, prompt):
+        """
+        Returns the cached response body of the most similar prompt in a namespace, or None if none is similar enough.
+        :param namespace: The cache namespace, e.g. the endpoint name of the chat model.
+        """
+        vector = self.embed(prompt)
+        keys = self._signature(namespace, vector)
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for key in keys:
+                candidates.update(self._buckets.get(key, ()))
+            best, best_similarity = None, self.threshold
+            for entry_id in candidates:
+                entry_vector, _, content, expires = self._entries[entry_id]
+                if expires is not None and expires < now:
+                    self._remove(entry_id)
+                    continue
+                similarity = self._similarity(vector, entry_vector)
+                if similarity >= best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return self._entries[best][2]
+
+    def set(self, namespace, prompt, content):
+        """
+        Caches the response body of a prompt, evicting the least recently used entries to stay under max_entries.
+        """
+        vector = self.embed(prompt)
+        keys = self._signature(namespace, vector)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (vector, keys, content, expires)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        """
+        :return: The number of entries, hits and misses, and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+class DiskCache:
+    """
+    On-disk response cache storing one file per entry, suitable for sharing between processes.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", cache=DiskCache("./.freejourney-cache"))
+    """
+    _HEADER = struct.Struct('<d')
+
+    def __init__(self, directory):
+        """
+        Creates an instance of DiskCache.
+        :param directory: The directory to store the cache entries in; it is created if missing.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        Returns the cached response body for a key, or None if it is missing or expired.
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, = self._HEADER.unpack(f.read(self._HEADER.size))
+                if expires and expires < time.time():
+                    content = None
+                else:
+                    return f.read()
+        except (OSError, struct.error):
+            return None
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        return content
+
+    def set(self, key, content, ttl=None):
+        """
+        Caches a response body.
+        :param ttl: Seconds the entry stays valid, or None to keep it until cleared.
+        """
+        expires = time.time() + ttl if ttl is not None else 0
+        temporary = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(self._HEADER.pack(expires))
+            f.write(content)
+        os.replace(temporary, self._path(key))
+
+    def clear(self):
+        for entry in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, entry))
+            except OSError:
+                pass
+
+class TextFilter:
+    """
+    Local pre-check for filter_text: an Aho-Corasick automaton over a list of moderated words, finding whether a text
+    contains any of them in a single pass. Texts without any are known to come back unchanged, so the request is
+    skipped; the others are still filtered by the API. Matching is case-insensitive and ignores word boundaries,
+    which only costs an extra request for false positives such as "class" containing "ass".
+    :example:
+    # Usage example:
+    text_filter = TextFilter.from_url("https://example.com/moderated-words.txt")
+    freejourney = Freejourney("<your_token_here>", text_filter=text_filter)
+    result = freejourney.filter_text("Have a nice day!")
+    """
+    def __init__(self, words):
+        """
+        Creates an instance of TextFilter.
+        :param words: The moderated words; it should be at least as inclusive as the API's own list.
+        """
+        # State 0 is the root; each state has its transitions, failure link, and whether a word ends there.
+        goto = [{}]
+        fail = [0]
+        terminal = [False]
+        for word in words:
+            word = word.strip().casefold()
+            if not word:
+                continue
+            state = 0
+            for character in word:
+                following = goto[state].get(character)
+                if following is None:
+                    following = goto[state][character] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    terminal.append(False)
+                state = following
+            terminal[state] = True
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, following in goto[state].items():
+                queue.append(following)
+                link = fail[state]
+                while link and character not in goto[link]:
+                    link = fail[link]
+                fail[following] = goto[link].get(character, 0) if state else 0
+                # A word ending at the longest suffix also ends here.
+                terminal[following] = terminal[following] or terminal[fail[following]]
+        self._goto = goto
+        self._fail = fail
+        self._terminal = terminal
+        self.size = len(goto)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Builds a TextFilter from a file of one word per line; empty lines and lines starting with # are ignored.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(line for line in f if not line.startswith('#'))
+
+    @classmethod
+    def from_url(cls, url, path=None, max_age=None):
+        """
+        Builds a TextFilter from a word list downloaded once and cached on disk.
+        :param url: The URL of a file of one word per line.
+        :param path: Where to cache the file; defaults to ~/.cache/freejourney, named after the URL.
+        :param max_age: Seconds after which the cached file is downloaded again, or None to keep it forever.
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache', 'freejourney',
+                                hashlib.sha256(url.encode()).hexdigest()[:32] + '.txt')
+        try:
+            fresh = max_age is None or time.time() - os.path.getmtime(path) < max_age
+        except OSError:
+            fresh = False
+        if not fresh:
+            response = requests.get(url, timeout=Timeout().read)
+            response.raise_for_status()
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, 'wb') as f:
+                f.write(response.content)
+            os.replace(temporary, path)
+        return cls.from_file(path)
+
+    def matches(self, text):
+        """
+        :return: Whether the text contains any of the moderated words.
+        """
+        goto, fail, terminal = self._goto, self._fail, self._terminal
+        state = 0
+        for character in text.casefold():
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            if terminal[state]:
+                return True
+        return False
+
+class JSONSerializer:
+    """
+    Serializes request bodies and parses response bodies with the standard json module.
+    Any object with the same dumps() and loads() methods can be given as a Freejourney serializer.
+    """
+    def dumps(self, obj):
+        """
+        :return: The JSON encoding of obj, as bytes.
+        """
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    def loads(self, content):
+        """
+        :param content: A JSON document, as bytes or a memoryview.
+        :return: The decoded document.
+        """
+        return json.loads(bytes(content) if isinstance(content, memoryview) else content)
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    JSONSerializer using the 'orjson' package, which encodes to and parses from bytes directly.
+    """
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("OrjsonSerializer requires the 'orjson' package.")
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+def default_serializer():
+    """
+    :return: An OrjsonSerializer if orjson is installed, a JSONSerializer otherwise.
+    """
+    return OrjsonSerializer() if orjson is not None else JSONSerializer()
+
+# Size from which response bodies have their image strings sliced out instead of parsed, in bytes.
+IMAGE_SLICING_SIZE = 64 * 1024
+
+_SPACES = re.compile(rb'[ \t\r\n]*')
+_PLACEHOLDER = '\x00image:'
+
+def _find_images(content):
+    """
+    Finds the string values of the "base64" fields of a raw JSON document, single or in arrays.
+    :return: The (start, end) spans of the values, quotes included, or None if one contains escapes or is not a
+        string, in which case the document must be parsed normally.
+    """
+    spans = []
+    skip = _SPACES.match
+    position = content.find(b'"base64"')
+    while position >= 0:
+        i = skip(content, position + 8).end()
+        if content[i:i + 1] == b':':
+            i = skip(content, i + 1).end()
+            in_array = content[i:i + 1] == b'['
+            if in_array:
+                i = skip(content, i + 1).end()
+            while not (in_array and content[i:i + 1] == b']'):
+                if content[i:i + 1] != b'"':
+                    return None
+                end = content.find(b'"', i + 1)
+                if end < 0 or content.find(b'\\', i + 1, end) >= 0:
+                    return None
+                spans.append((i, end + 1))
+                i = skip(content, end + 1).end()
+                if not in_array:
+                    break
+                if content[i:i + 1] == b',':
+                    i = skip(content, i + 1).end()
+        position = content.find(b'"base64"', i)
+    return spans
+
+def _restore_images(data, images):
+    """
+    Puts back, in place, the image strings that _find_images had replaced by placeholders.
+    """
+    items = data.items() if isinstance(data, dict) else enumerate(data) if isinstance(data, list) else ()
+    for key, value in items:
+        if isinstance(value, str) and value.startswith(_PLACEHOLDER):
+            data[key] = images[int(value[len(_PLACEHOLDER):])]
+        elif isinstance(value, (dict, list)):
+            _restore_images(value, images)
+    return data
+
+Endpoint = namedtuple('Endpoint', ['group', 'name', 'label', 'method', 'fields', 'check_success'])
+Endpoint.__doc__ = """
+Declaration of a Freejourney method calling an endpoint of endpoints.json.
+:param group: The endpoint group in endpoints.json, e.g. 'IMAGES'.
+:param name: The endpoint name within the group, e.g. 'QRCode'.
+:param label: The name used in error messages.
+:param method: The HTTP method to use.
+:param fields: (argument, JSON field) pairs mapping the method's arguments to the request body.
+:param check_success: Whether to raise when the response's 'success' flag is not set.
+"""
+
+ENDPOINTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'constants', 'endpoints.json')
+
+@functools.lru_cache(maxsize=None)
+def load_endpoints(path=ENDPOINTS_PATH):
+    """
+    Loads endpoints.json once per process; every client shares the returned dictionary, which must not be modified.
+    :param path: The path of the endpoints file, resolved relative to this module by default.
+    :return: The endpoints, keyed by group then name, plus the 'BASE' URL.
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _endpoint(group, name, label, params=(), method='POST', defaults=None, check_success=False, doc=None):
+    """
+    Declares a Freejourney method calling an endpoint of endpoints.json.
+    :param params: The names of the method's arguments, in order. They are sent as JSON fields of the same name,
+        unless given as an (argument, field) pair.
+    :param defaults: Default values of the method's arguments, keyed by argument name.
+    :return: The method; its declaration is available as its `endpoint` attribute.
+    """
+    fields = tuple(param if isinstance(param, tuple) else (param, param) for param in params)
+    defaults = defaults or {}
+    signature = inspect.Signature(
+        [inspect.Parameter('self', inspect.Parameter.POSITIONAL_OR_KEYWORD)] +
+        [inspect.Parameter(argument, inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                           default=defaults.get(argument, inspect.Parameter.empty)) for argument, _ in fields])
+
+    def call(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        payload = {field: arguments.arguments[argument] for argument, field in fields} if method == 'POST' else None
+        return self._call(method, group, name, label, payload, check_success)
+
+    call.__signature__ = signature
+    call.__doc__ = doc
+    call.endpoint = Endpoint(group, name, label, method, fields, check_success)
+    return call
 
 class Freejourney:
-    def __init__(self, token):
+    def __init__(self, token, pool_connections=10, pool_maxsize=10, keep_alive=True, idle_timeout=None,
+                 cache=None, cache_ttl=3600, cache_ttls=None, never_cache=NEVER_CACHE,
+                 rate_limit=None, group_rate_limits=None, adaptive_concurrency=None,
+                 timeout=Timeout(), retry=None, hedge_after=None, hedged_endpoints=HEDGED,
+                 image_results=False, base_url=None, session=None, coalesce=False, metrics=None, text_filter=None,
+                 load_balancer=None, typed_results=False, semantic_cache=None, compress_requests=None,
+                 compress_threshold=16384, serializer=None, scheduler=None, transport=None):
         """
         Creates an instance of Freejourney.
-        :param token: The token to use for all further requests.
+        :param token: The token to use for all further requests, or a list of tokens to spread requests over.
+        :param pool_connections: The number of per-host connection pools to keep cached.
+        :param pool_maxsize: The maximum number of connections kept open to a single host.
+        :param keep_alive: Whether connections are kept open and reused between requests.
+        :param idle_timeout: Seconds after which idle pooled connections are dropped, or None to keep them. A session
+            given with session= is left to its owner.
+        :param cache: A response cache such as MemoryCache or DiskCache, or None to disable caching.
+        :param cache_ttl: Seconds a cached response stays valid, or None to keep it until evicted.
+        :param cache_ttls: Per-endpoint TTL overrides keyed by endpoint name, e.g. {'QRCode': 86400}.
+        :param never_cache: Endpoint names whose responses are never cached.
+        :param rate_limit: A TokenBucket, or a number of requests per second, applied to every request.
+        :param group_rate_limits: TokenBuckets or requests per second keyed by endpoint group, e.g. {'IMAGES': 2}.
+        :param adaptive_concurrency: An AdaptiveConcurrency, or a maximum number of requests in flight,
+            which backs off whenever the API answers with HTTP 429.
+        :param timeout: A Timeout, or a number of seconds used for both the connect and read timeouts.
+        :param retry: A RetryPolicy, or None to make a single attempt per call.
+        :param hedge_after: Seconds after which a second, identical request is sent to a hedged endpoint
+            if the first one has not answered yet; the first response wins. None disables hedging.
+        :param hedged_endpoints: The endpoint names eligible for hedging.
+        :param image_results: Whether image endpoints return their images as lazily decoded Image objects
+            instead of base64 strings.
+        :param base_url: The API root URL, defaulting to the 'BASE' URL of endpoints.json, or a list of URLs to spread
+            requests over.
+        :param session: An existing session to send requests through, e.g. to share one connection pool between
+            clients using different tokens. It is left open by close().
+        :param coalesce: Whether concurrent identical calls share a single HTTP request and its response.
+            Endpoints listed in never_cache are never coalesced.
+        :param metrics: A Metrics instance recording per-endpoint statistics, or None to disable instrumentation.
+        :param text_filter: A TextFilter answering filter_text locally for texts without any moderated word.
+        :param load_balancer: A LoadBalancer, which then replaces token and base_url, or the LoadBalancer strategy
+            to use when token or base_url is a list; round robin by default. close() stops the load balancers it
+            created.
+        :param typed_results: Whether methods return compact Result objects, such as Trivia or Completion, instead of
+            dictionaries.
+        :param semantic_cache: A SemanticCache reusing the completions of near-identical prompts for the chat methods,
+            per model. A reused completion keeps the prompt it was created for.
+        :param compress_requests: 'gzip', or 'zstd' with the 'zstandard' package, to compress request bodies of at
+            least compress_threshold bytes. Endpoints answering a compressed request with HTTP 415 are then sent
+            uncompressed bodies. Compressed responses are always accepted and decompressed as they are read.
+        :param compress_threshold: The minimum size of a request body worth compressing, in bytes.
+        :param serializer: A JSONSerializer, OrjsonSerializer or any object with the same dumps() and loads()
+            methods; defaults to default_serializer().
+        :param scheduler: A PriorityScheduler admitting requests by priority class, e.g. to keep the chat methods
+            responsive while image jobs run in bulk. Keep pool_maxsize at least as large as its limit.
+        :param transport: A requests transport adapter sending the requests instead of the pooled HTTPAdapter, such as
+            a cassette.CassetteAdapter recording or replaying responses. It is ignored when a session is given.
         """
-        self.token = token
-        with open("./src/constants/endpoints.json", 'r') as f:
-            self.endpoints = json.load(f)
-            
-    def chat_gpt4(self, prompt):
+        self.endpoints = load_endpoints()
+        tokens = [token] if isinstance(token, str) else list(token)
+        base_urls = [base_url or self.endpoints['BASE']] if base_url is None or isinstance(base_url, str) else \
+            list(base_url)
+        self._owns_load_balancer = not isinstance(load_balancer, LoadBalancer)
+        if self._owns_load_balancer and (len(tokens) > 1 or len(base_urls) > 1 or load_balancer is not None):
+            load_balancer = LoadBalancer(tokens, base_urls, strategy=load_balancer or LoadBalancer.ROUND_ROBIN)
+        self.load_balancer = load_balancer
+        self.token = tokens[0]
+        self.base_url = base_urls[0]
+        self._headers = {'X-Freejourney-Key': self.token}
+        if not keep_alive:
+            self._headers['Connection'] = 'close'
+        self.idle_timeout = idle_timeout
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        if compress_requests not in (None, 'gzip', 'zstd'):
+            raise ValueError(f"Unsupported request compression: {compress_requests}")
+        if compress_requests == 'zstd' and zstandard is None:
+            raise ImportError("zstd request compression requires the 'zstandard' package.")
+        self.compress_requests = compress_requests
+        self.serializer = serializer if serializer is not None else default_serializer()
+        self.compress_threshold = compress_threshold
+        # URLs which rejected a compressed body; shared by the copies made by with_options.
+        self._uncompressed_urls = set()
+        self.cache_ttl = cache_ttl
+        self.cache_ttls = cache_ttls or {}
+        self.never_cache = frozenset(never_cache)
+        self.rate_limit = self._token_bucket(rate_limit)
+        self.group_rate_limits = {group: self._token_bucket(limit) for group, limit in (group_rate_limits or {}).items()}
+        if adaptive_concurrency is not None and not isinstance(adaptive_concurrency, AdaptiveConcurrency):
+            adaptive_concurrency = AdaptiveConcurrency(max_limit=adaptive_concurrency)
+        self.concurrency = adaptive_concurrency
+        self.scheduler = scheduler
+        self.timeout = self._timeout(timeout)
+        self.retry = retry
+        self.hedge_after = hedge_after
+        self.hedged_endpoints = frozenset(hedged_endpoints)
+        self._hedge_executor = None
+        self.image_results = image_results
+        self.typed_results = typed_results
+        self.coalesce = coalesce
+        self.metrics = metrics
+        self.text_filter = text_filter
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self.transport = transport
+        self._owns_session = session is None
+        self.session = session if session is not None else self._create_session(pool_connections, pool_maxsize,
+                                                                                keep_alive)
+
+    def _create_session(self, pool_connections, pool_maxsize, keep_alive):
+        session = requests.Session()
+        adapter = self.transport or HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _url(self, group, name):
+        return self.base_url + self.endpoints[group][name]
+
+    def _route(self, group, name):
+        """
+        Picks where to send a request; a backend picked by the load balancer must be released once it completes.
+        :return: The backend, or None without a load balancer, and the URL and headers of the request.
+        """
+        if self.load_balancer is None:
+            return None, self._url(group, name), self._headers
+        backend = self.load_balancer.acquire()
+        return (backend, backend.base_url + self.endpoints[group][name],
+                dict(self._headers, **{'X-Freejourney-Key': backend.token}))
+
+    def _encode(self, url, payload, headers, compress=True):
+        """
+        Serializes a request body, compressed if it is large enough and the URL accepts compressed bodies.
+        :return: The body, or None without payload, the headers to send it with, and the number of bytes saved by
+            compression.
+        """
+        if payload is None:
+            return None, headers, 0
+        body = self.serializer.dumps(payload)
+        headers = dict(headers, **{'Content-Type': 'application/json'})
+        if (not compress or self.compress_requests is None or len(body) < self.compress_threshold or
+                url in self._uncompressed_urls):
+            return body, headers, 0
+        if self.compress_requests == 'zstd':
+            compressed = zstandard.ZstdCompressor().compress(body)
+        else:
+            compressed = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = self.compress_requests
+        return compressed, headers, len(body) - len(compressed)
+
+    def _rejected_compression(self, url, status, headers):
+        """
+        Remembers that a URL does not accept compressed bodies if it answered one with HTTP 415.
+        :param headers: The headers the request was sent with.
+        :return: Whether the request must be sent again, uncompressed.
+        """
+        if status != 415 or 'Content-Encoding' not in headers:
+            return False
+        self._uncompressed_urls.add(url)
+        return True
+
+    def _count_received(self, name, headers, content, wire_size=None, saved=0):
+        """
+        Records the bytes received for a response, and those saved if it or its request was compressed.
+        :param saved: The bytes saved by compressing the request.
+        :param wire_size: The size of the body on the wire, if known; defaults to its Content-Length when compressed.
+        """
+        if headers.get('Content-Encoding', 'identity') != 'identity':
+            if not wire_size:
+                wire_size = int(headers.get('Content-Length') or 0) or len(content)
+            saved += max(0, len(content) - wire_size)
+        if saved:
+            self.metrics.increment(name, 'bytes_saved', saved)
+        self.metrics.increment(name, 'bytes_received', wire_size or len(content))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes all pooled connections held by this instance.
+        """
+        if self._owns_session:
+            self.session.close()
+        if self._owns_load_balancer and self.load_balancer is not None:
+            self.load_balancer.close()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+
+    def with_options(self, **options):
+        """
+        Returns a copy of this instance with different per-call options, sharing its connection pool,
+        cache and rate limits.
+        :param options: Any of timeout, retry, hedge_after and hedged_endpoints.
+        :return: The configured copy.
+        :example:
+        # Usage example:
+        freejourney = Freejourney("<your_token_here>")
+        result = freejourney.with_options(timeout=Timeout(total=5), retry=None).dad_joke()
+        """
+        clone = copy.copy(self)
+        for option, value in options.items():
+            if option not in ('timeout', 'retry', 'hedge_after', 'hedged_endpoints'):
+                raise TypeError(f"Unknown option: {option}")
+            if option == 'timeout':
+                value = self._timeout(value)
+            elif option == 'hedged_endpoints':
+                value = frozenset(value)
+            setattr(clone, option, value)
+        return clone
+
+    def _call(self, method, group, name, label, payload=None, check_success=False):
+        """
+        Sends a request to an endpoint over the pooled session.
+        :param method: The HTTP method to use.
+        :param group: The endpoint group in endpoints.json, e.g. 'IMAGES'.
+        :param name: The endpoint name within the group, e.g. 'QRCode'.
+        :param label: The name used in error messages.
+        :param payload: The JSON body to send, if any.
+        :param check_success: Whether to raise when the response's 'success' flag is not set.
+        :return: The 'data' field of the response.
+        """
+        key = self._request_key(name, payload)
+        content = self.cache.get(key) if key is not None and self.cache is not None else None
+        namespace = self._semantic_namespace(group, name, payload)
+        if content is None and namespace is not None:
+            content = self.semantic_cache.get(namespace, payload['prompt'])
+        if content is not None:
+            if self.metrics is not None:
+                self.metrics.increment(name, 'cache_hits')
+            return self._result(group, name, self._parse(content, label, check_success))
+        if key is not None and self.coalesce:
+            content = self._fetch_shared(key, method, group, name, label, payload)
+        else:
+            content = self._fetch(method, group, name, label, payload)
+        data = self._parse(content, label, check_success)
+        if key is not None and self.cache is not None:
+            self.cache.set(key, content, self.cache_ttls.get(name, self.cache_ttl))
+        if namespace is not None:
+            self.semantic_cache.set(namespace, payload['prompt'], content)
+        return self._result(group, name, data)
+
+    def _fetch_shared(self, key, method, group, name, label, payload):
+        """
+        Performs a call, or waits for an identical call already in flight in another thread and shares its response.
+        :return: The raw response body.
+        """
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            if self.metrics is not None:
+                self.metrics.increment(name, 'coalesced')
+            return future.result()
+        try:
+            content = self._fetch(method, group, name, label, payload)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(content)
+            return content
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+    def _fetch(self, method, group, name, label, payload):
+        """
+        Performs a call, retrying and hedging it as configured.
+        :return: The raw response body.
+        """
+        deadline = time.monotonic() + self.timeout.total if self.timeout.total is not None else None
+        attempt = 1
+        while True:
+            try:
+                if self.hedge_after is not None and name in self.hedged_endpoints:
+                    return self._send_hedged(method, group, name, label, payload, deadline)
+                return self._send(method, group, name, label, payload, deadline)
+            except FreejourneyError as err:
+                delay = self._retry_delay(attempt, err, name, label, deadline)
+            time.sleep(delay)
+            attempt += 1
+
+    def _send_hedged(self, method, group, name, label, payload, deadline):
+        """
+        Sends a request and, if it has not completed after hedge_after seconds, an identical one.
+        :return: The raw response body of whichever request succeeds first.
+        """
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(thread_name_prefix='freejourney-hedge')
+        args = (method, group, name, label, payload, deadline)
+        pending = {self._hedge_executor.submit(self._send, *args)}
+        done, _ = wait(pending, timeout=self.hedge_after)
+        if not done:
+            pending.add(self._hedge_executor.submit(self._send, *args))
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower request cannot be interrupted; its response is simply discarded.
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _retry_delay(self, attempt, error, name, label, deadline):
+        """
+        Decides whether a failed call is retried.
+        :return: The number of seconds to wait before the next attempt.
+        :raises FreejourneyError: The original error if the call should not be retried.
+        """
+        delay = self.retry.delay(attempt, error, name) if self.retry is not None else None
+        if delay is None:
+            raise error
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise FreejourneyError(f"{label} request failed: deadline exceeded after {attempt} attempt(s): {error}",
+                                   error.status, error.retry_after) from error
+        if self.metrics is not None:
+            self.metrics.increment(name, 'retries')
+        return delay
+
+    @staticmethod
+    def _timeout(timeout):
+        if timeout is None:
+            return Timeout(None, None, None)
+        if isinstance(timeout, Timeout):
+            return timeout
+        return Timeout(timeout, timeout, None)
+
+    def _remaining(self, label, deadline):
+        """
+        Returns the number of seconds left before the deadline of a call, or None if it has none.
+        """
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise FreejourneyError(f"{label} request failed: deadline exceeded")
+        return remaining
+
+    def _send(self, method, group, name, label, payload, deadline=None):
+        """
+        Performs a single HTTP request, honouring the rate limits and the concurrency governor.
+        :return: The raw response body.
+        """
+        delay = self._rate_limit_delay(group)
+        if delay > 0:
+            time.sleep(delay)
+        now = time.monotonic()
+        if self._owns_session and self.idle_timeout is not None and now - self._last_used > self.idle_timeout:
+            # Drop pooled sockets the server has most likely closed on its side already; a shared session is left
+            # to its owner.
+            self.session.close()
+        self._last_used = now
+        remaining = self._remaining(label, deadline)
+        ticket = self._schedule(group, name, label, remaining)
+        if ticket is not None and deadline is not None:
+            # Leave out the time spent waiting for the scheduler.
+            try:
+                remaining = self._remaining(label, deadline)
+            except FreejourneyError:
+                self.scheduler.release(ticket)
+                raise
+        read_timeout = self.timeout.read
+        if remaining is not None:
+            read_timeout = remaining if read_timeout is None else min(read_timeout, remaining)
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        metrics = self.metrics
+        backend, url, headers = self._route(group, name)
+        started = time.perf_counter() if metrics is not None or backend is not None else None
+        retry_after = throttled = status = None
+        try:
+            body, request_headers, saved = self._encode(url, payload, headers)
+            response = self.session.request(method, url, data=body, headers=request_headers,
+                                            timeout=(self.timeout.connect, read_timeout))
+            if self._rejected_compression(url, response.status_code, request_headers):
+                response.close()
+                body, request_headers, saved = self._encode(url, payload, headers, compress=False)
+                response = self.session.request(method, url, data=body, headers=request_headers,
+                                                timeout=(self.timeout.connect, read_timeout))
+            status = response.status_code
+            if response.status_code == 429:
+                throttled = True
+                retry_after = self._throttled(group, response.headers.get('Retry-After'))
+            response.raise_for_status()
+            content = response.content
+            if metrics is not None:
+                metrics.observe(name, 'total', time.perf_counter() - started)
+                metrics.observe(name, 'ttfb', response.elapsed.total_seconds())
+                metrics.increment(name, 'requests')
+                metrics.increment(name, 'bytes_sent', len(response.request.body or b''))
+                # The raw stream counts the bytes read before decompression.
+                self._count_received(name, response.headers, content, response.raw.tell(), saved)
+            return content
+        except requests.exceptions.HTTPError as http_err:
+            if metrics is not None:
+                metrics.increment(name, 'requests')
+                metrics.error(name, http_err.response.status_code)
+            error = RateLimitError if throttled else FreejourneyError
+            raise error(f"{label} request failed: {http_err}", http_err.response.status_code, retry_after)
+        except Exception as err:
+            # The body may have failed to arrive after the status did.
+            status = None
+            if metrics is not None:
+                metrics.increment(name, 'requests')
+                metrics.error(name, None)
+            raise FreejourneyError(f"An error occurred: {err}")
+        finally:
+            if backend is not None:
+                self.load_balancer.release(backend, time.perf_counter() - started, status, retry_after)
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            if self.concurrency is not None:
+                self.concurrency.release(self._outcome(status))
+
+    @staticmethod
+    def _outcome(status):
+        """
+        :param status: The HTTP status of a response, or None if none was received.
+        :return: The outcome of the request for the concurrency governor.
+        """
+        if status == 429:
+            return AdaptiveConcurrency.THROTTLED
+        if status is None or status >= 500:
+            return AdaptiveConcurrency.ERROR
+        return AdaptiveConcurrency.SUCCESS
+
+    def _schedule(self, group, name, label, timeout):
+        """
+        Waits for the scheduler to admit a request, if there is one.
+        :param timeout: The number of seconds left before the deadline of the call, or None if it has none.
+        :return: The ticket to release once the request completes, or None without scheduler.
         """
+        if self.scheduler is None:
+            return None
+        ticket = self.scheduler.acquire(group, name, timeout)
+        if ticket is None:
+            raise FreejourneyError(f"{label} request failed: deadline exceeded")
+        if self.metrics is not None:
+            self.metrics.observe(name, 'queue_wait', ticket.waited)
+        return ticket
+
+    @staticmethod
+    def _token_bucket(limit):
+        if limit is None or isinstance(limit, TokenBucket):
+            return limit
+        return TokenBucket(limit)
+
+    def _rate_limit_delay(self, group):
+        """
+        Reserves a token from the global and group buckets.
+        :return: The number of seconds to wait before sending the request.
+        """
+        delay = 0
+        for bucket in (self.rate_limit, self.group_rate_limits.get(group)):
+            if bucket is not None:
+                delay = max(delay, bucket.reserve())
+        return delay
+
+    def _throttled(self, group, retry_after):
+        """
+        Pauses the rate limits of a throttled request for as long as the server asked.
+        :param retry_after: The value of the Retry-After header, in seconds or as an HTTP date.
+        :return: The number of seconds to wait, or None if the header was missing or invalid.
+        """
+        if retry_after is None:
+            return None
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        seconds = max(0.0, seconds)
+        for bucket in (self.rate_limit, self.group_rate_limits.get(group)):
+            if bucket is not None:
+                bucket.pause(seconds)
+        return seconds
+
+    def _parse(self, content, label, check_success):
+        """
+        Parses a response body. The base64 image strings of large bodies are sliced straight out of the raw bytes,
+        so that only the small rest of the document goes through the JSON parser.
+        :return: The 'data' field of the response.
+        """
+        try:
+            spans = _find_images(content) if len(content) >= IMAGE_SLICING_SIZE else None
+            data = self._parse_sliced(content, spans) if spans else self.serializer.loads(content)
+        except Exception as err:
+            raise FreejourneyError(f"An error occurred: {err}")
+        if check_success and not data.get('success'):
+            raise FreejourneyError(f"{label} failed: {data.get('message')}")
+        return data.get('data', {}) if check_success else data['data']
+
+    def _parse_sliced(self, content, spans):
+        """
+        Parses a body with placeholders in place of its image strings, then puts the strings back.
+        :param spans: The spans of the image strings, as found by _find_images.
+        """
+        view = memoryview(content)
+        parts = []
+        images = []
+        previous = 0
+        for index, (start, end) in enumerate(spans):
+            parts.append(view[previous:start])
+            parts.append(b'"\\u0000image:%d"' % index)
+            images.append(str(view[start + 1:end - 1], 'ascii'))
+            previous = end
+        parts.append(view[previous:])
+        return _restore_images(self.serializer.loads(b''.join(parts)), images)
+
+    def _result(self, group, name, data):
+        """
+        Converts the data of a response into the value returned to the caller.
+        """
+        if self.image_results and group == 'IMAGES':
+            data = Image.wrap(data)
+        if self.typed_results and isinstance(data, dict):
+            result_type = RESULT_TYPES.get(name) or RESULT_TYPES.get(group)
+            if result_type is not None:
+                return result_type.from_data(data)
+        return data
+
+    def _semantic_namespace(self, group, name, payload):
+        """
+        :return: The semantic cache namespace of a chat completion request, or None if it is not semantically cached.
+        """
+        if self.semantic_cache is None or group != 'CHAT_COMPLETION' or not isinstance(payload.get('prompt'), str):
+            return None
+        return f"{name}:{payload.get('model')}" if name == 'Characters' else name
+
+    def _request_key(self, name, payload):
+        """
+        Builds the key identifying a request for caching and coalescing, from its endpoint name and normalized JSON body.
+        :return: The key, or None if the request must not be cached or coalesced.
+        """
+        if (self.cache is None and not self.coalesce) or name in self.never_cache:
+            return None
+        body = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(f"{name}\n{body}".encode()).hexdigest()
+
+    chat_gpt4 = _endpoint('CHAT_COMPLETION', 'ChatGPT-4', 'ChatGPT-4', ['prompt'], doc="""
         Creates a chat completion using the ChatGPT-4 model.
         :param prompt: The text prompt to send to ChatGPT-4.
         :return: A dictionary containing the prompt and completion text.
@@ -24,20 +2227,9 @@ class Freejourney:
         # Output: "What is 1 + 1?"
         print(result['completion'])
         # Output: "1 + 1 equals 2."
-        """
-        try:
-            request = requests.post(self.endpoints['BASE'] + self.endpoints['CHAT_COMPLETION']['ChatGPT-4'],
-                                    json={'prompt': prompt},
-                                    headers={'X-Freejourney-Key': self.token})
-            request.raise_for_status()
-            return request.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"ChatGPT-4 request failed: {http_err}") 
-        except Exception as err:
-            raise Exception(f"An error occured: {err}")  
-        
-    def chat_gpt4_34k(self, prompt):
-        """
+        """)
+
+    chat_gpt4_34k = _endpoint('CHAT_COMPLETION', 'ChatGPT-4-34k', 'ChatGPT-4 34k', ['prompt'], doc="""
         Creates a chat completion using the ChatGPT-4 34k model.
         :param prompt: The text prompt to send to ChatGPT-4 34k.
         :return: A dictionary containing the prompt and completion text.
@@ -51,20 +2243,9 @@ class Freejourney:
 
         print(result['completion'])
         # Output: "1 + 1 equals 2."
-        """
-        try:
-            request = requests.post(self.endpoints['BASE'] + self.endpoints['CHAT_COMPLETION']['ChatGPT-4-34k'],
-                                    json={'prompt': prompt},
-                                    headers={'X-Freejourney-Key': self.token})
-            request.raise_for_status()
-            return request.json()['data']    
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"ChatGPT-4 34k request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occured: {err}")         
-    
-    def chat_gpt3_5_turbo(self, prompt):
-        """
+        """)
+
+    chat_gpt3_5_turbo = _endpoint('CHAT_COMPLETION', 'ChatGPT-3-5-Turbo', 'ChatGPT-3.5 Turbo', ['prompt'], doc="""
         Creates a chat completion using the ChatGPT-3.5 Turbo model.
         :param prompt: The text prompt to send to ChatGPT-3.5 Turbo.
         :return: A dictionary containing the prompt and completion text.
@@ -78,20 +2259,10 @@ class Freejourney:
 
         print(result['completion'])
         # Output: "1 + 1 equals 2."
-        """
-        try:
-            request = requests.post(self.endpoints['BASE'] + self.endpoints['CHAT_COMPLETION']['ChatGPT-3-5-Turbo'],
-                                    json={'prompt': prompt},
-                                    headers={'X-Freejourney-Key': self.token})
-            request.raise_for_status()
-            return request.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"ChatGPT-3.5 Turbo request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def chat_gpt3_5_turbo_16k(self, prompt):
-        """
+        """)
+
+    chat_gpt3_5_turbo_16k = _endpoint('CHAT_COMPLETION', 'ChatGPT-3-5-Turbo-16k', 'ChatGPT-3.5 Turbo 16k', ['prompt'],
+                                      doc="""
         Creates a chat completion using the ChatGPT-3.5 Turbo 16k model.
         :param prompt: The text prompt to send to ChatGPT-3.5 Turbo 16k.
         :return: A dictionary containing the prompt and completion text.
@@ -105,20 +2276,9 @@ class Freejourney:
 
         print(result['completion'])
         # Output: "1 + 1 equals 2."
-        """
-        try:
-            request = requests.post(self.endpoints['BASE'] + self.endpoints['CHAT_COMPLETION']['ChatGPT-3-5-Turbo-16k'],
-                                    json={'prompt': prompt},
-                                    headers={'X-Freejourney-Key': self.token})
-            request.raise_for_status()
-            return request.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"ChatGPT-3.5 Turbo 16k request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def gemini(self, prompt):
-        """
+        """)
+
+    gemini = _endpoint('CHAT_COMPLETION', 'Gemini', 'Gemini', ['prompt'], doc="""
         Creates a chat completion using the Gemini model.
         :param prompt: The text prompt to send to Gemini.
         :return: A dictionary containing the prompt and completion text.
@@ -132,21 +2292,9 @@ class Freejourney:
 
         print(result['completion'])
         # Output: "1 + 1 equals 2."
-        """
-        try:
-            request = requests.post(self.endpoints['BASE'] + self.endpoints['CHAT_COMPLETION']['Gemini'],
-                                    json={'prompt': prompt},
-                                    headers={'X-Freejourney-Key': self.token})
-            request.raise_for_status()
-            return request.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Gemini request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
+        """)
 
-    def character(self, model, prompt):
-        """
+    character = _endpoint('CHAT_COMPLETION', 'Characters', 'Character model', ['model', 'prompt'], doc="""
         Creates a chat completion for a given character.
         :param model: ID of the character model.
         :param prompt: The text prompt to send to the character model.
@@ -164,20 +2312,9 @@ class Freejourney:
         
         print(result['model'])
         # Output: {'model_id': 'steve_harrington', ... }
-        """
-        try:
-            request = requests.post(self.endpoints['BASE'] + self.endpoints['CHAT_COMPLETION']['Characters'],
-                                    json={'prompt': prompt, 'model': model},
-                                    headers={'X-Freejourney-Key': self.token})
-            request.raise_for_status()
-            return request.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Character model request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def dad_joke(self):
-        """
+        """)
+
+    dad_joke = _endpoint('FUN', 'DadJoke', 'Dad joke', method='GET', doc="""
         Returns a random "Dad joke".
         :return: A dictionary containing the joke.
         :example:
@@ -187,19 +2324,9 @@ class Freejourney:
 
         print(result['joke'])
         # Output: "No matter how kind you are, German children are kinder."
-        """
-        try:
-            response = requests.get(self.endpoints['BASE'] + self.endpoints['FUN']['DadJoke'],
-                                    headers={'X-Freejourney-Key': self.token})
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Dad joke request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
+        """)
 
-    def trivia(self):
-        """
+    trivia = _endpoint('FUN', 'Trivia', 'Trivia', method='GET', doc="""
         Returns a random trivia question.
         :return: A dictionary containing the trivia question, possible answers, and difficulty level.
         :example:
@@ -218,19 +2345,9 @@ class Freejourney:
 
         print(result['difficulty'])
         # Output: "medium"
-        """
-        try:
-            response = requests.get(self.endpoints['BASE'] + self.endpoints['FUN']['Trivia'],
-                                    headers={'X-Freejourney-Key': self.token})
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Trivia request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def random_fact(self):
-        """
+        """)
+
+    random_fact = _endpoint('FUN', 'RandomFact', 'Random fact', method='GET', doc="""
         Returns a random fact.
         :return: A dictionary containing the random fact.
         :example:
@@ -240,19 +2357,9 @@ class Freejourney:
 
         print(result['fact'])
         # Output: "More bullets were fired in 'Starship Troopers' than any other movie ever made."
-        """
-        try:
-            response = requests.get(self.endpoints['BASE'] + self.endpoints['FUN']['RandomFact'],
-                                    headers={'X-Freejourney-Key': self.token})
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Random fact request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def cat_fact(self):
-        """
+        """)
+
+    cat_fact = _endpoint('ANIMALS', 'CatFact', 'Cat fact', method='GET', doc="""
         Returns a random cat fact.
         :return: A dictionary containing the random cat fact.
         :example:
@@ -262,19 +2369,9 @@ class Freejourney:
 
         print(result['fact'])
         # Output: "The ancestor of all domestic cats is the African Wild Cat which still exists today."
-        """
-        try:
-            response = requests.get(self.endpoints['BASE'] + self.endpoints['ANIMALS']['CatFact'],
-                                    headers={'X-Freejourney-Key': self.token})
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Cat fact request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
+        """)
 
-    def dog_fact(self):
-        """
+    dog_fact = _endpoint('ANIMALS', 'DogFact', 'Dog fact', method='GET', doc="""
         Returns a random dog fact.
         :return: A dictionary containing the random dog fact.
         :example:
@@ -284,20 +2381,12 @@ class Freejourney:
 
         print(result['fact'])
         # Output: "Two stray dogs in Afghanistan saved 50 American soldiers. A Facebook group raised $21,000 to bring the dogs back to the US and reunite them with the soldiers."
-        """
-        try:
-            response = requests.get(self.endpoints['BASE'] + self.endpoints['ANIMALS']['DogFact'],
-                                    headers={'X-Freejourney-Key': self.token})
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Dog fact request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def filter_text(self, text, fill="*"):
+        """)
+
+    def filter_text(self, text, fill='*'):
         """
         Filters a text, replacing all moderated words by * or a specified character.
+        With a text_filter, texts without any moderated word are returned unchanged without sending a request.
         :param text: The text to filter.
         :param fill: The character to use to replace moderated words. Accepted characters: _ ~ - = | *
         :return: A dictionary containing the original text and the filtered result.
@@ -312,21 +2401,28 @@ class Freejourney:
         print(result['result'])
         # Output: "Just shut the **** up bro, you're **** at this game!"
         """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['MODERATION']['TextFilter'],
-                json={'text': text, 'fill': fill},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Text filtering request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_qr_code(self, text):
+        result = self._filter_locally(text, fill)
+        if result is not None:
+            return result
+        return self._call('POST', 'MODERATION', 'TextFilter', 'Text filtering', {'text': text, 'fill': fill})
+
+    filter_text.endpoint = Endpoint('MODERATION', 'TextFilter', 'Text filtering', 'POST',
+                                    (('text', 'text'), ('fill', 'fill')), False)
+
+    def _filter_locally(self, text, fill):
+        """
+        Validates the arguments of filter_text and answers it without a request when the text is known to be clean.
+        :return: The result, or None if the API must be called.
         """
+        if fill not in FILL_CHARACTERS:
+            raise ValueError(f"Invalid fill character: {fill!r}; accepted characters: _ ~ - = | *")
+        if self.text_filter is None or not isinstance(text, str) or self.text_filter.matches(text):
+            return None
+        if self.metrics is not None:
+            self.metrics.increment('TextFilter', 'local_hits')
+        return self._result('MODERATION', 'TextFilter', {'text': text, 'result': text})
+
+    create_qr_code = _endpoint('IMAGES', 'QRCode', 'QR code creation', ['text'], doc="""
         Creates a QR code.
         :param text: The text/URL to use for the QR code.
         :return: A dictionary containing the base64-encoded QR code image.
@@ -337,22 +2433,9 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['QRCode'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"QR code creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def remove_background(self, image_url):
-        """
+        """)
+
+    remove_background = _endpoint('IMAGES', 'RemoveBackground', 'Background removal', [('image_url', 'text')], doc="""
         Removes the background of an image.
         :param image_url: The URL of the image to remove the background from.
         :return: A dictionary containing the base64-encoded image with the background removed.
@@ -363,22 +2446,9 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['RemoveBackground'],
-                json={'text': image_url},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Background removal request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_scroll_of_truth(self, text):
-        """
+        """)
+
+    create_scroll_of_truth = _endpoint('IMAGES', 'ScrollOfTruth', 'Scroll of Truth creation', ['text'], doc="""
         Creates a "Scroll of Truth" meme.
         :param text: The text to display on the meme.
         :return: A dictionary containing the base64-encoded image of the meme.
@@ -389,22 +2459,10 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['ScrollOfTruth'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Scroll of Truth creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_minecraft_achievement(self, text):
-        """
+        """)
+
+    create_minecraft_achievement = _endpoint('IMAGES', 'MinecraftAchievement', 'Minecraft Achievement creation', ['text'],
+                                             doc="""
         Creates a "Minecraft Achievement" meme.
         :param text: The text to display on the achievement.
         :return: A dictionary containing the base64-encoded image of the meme.
@@ -415,22 +2473,10 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['MinecraftAchievement'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Minecraft Achievement creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
+        """)
 
-    def create_minecraft_challenge(self, text):
-        """
+    create_minecraft_challenge = _endpoint('IMAGES', 'MinecraftChallenge', 'Minecraft Challenge creation', ['text'],
+                                           doc="""
         Creates a "Minecraft Challenge" meme.
         :param text: The text to display on the challenge.
         :return: A dictionary containing the base64-encoded image of the meme.
@@ -441,22 +2487,9 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['MinecraftChallenge'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Minecraft Challenge creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_calling_meme(self, text):
-        """
+        """)
+
+    create_calling_meme = _endpoint('IMAGES', 'Calling', 'Calling meme creation', ['text'], doc="""
         Creates a "Calling" meme.
         :param text: The text to display on the meme.
         :return: A dictionary containing the base64-encoded image of the meme.
@@ -467,22 +2500,9 @@ class Freejourney:
         
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['Calling'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Calling meme creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_captcha_meme(self, text):
-        """
+        """)
+
+    create_captcha_meme = _endpoint('IMAGES', 'Captcha', 'Captcha meme creation', ['text'], doc="""
         Creates a "Captcha" meme.
         :param text: The text to display on the meme.
         :return: A dictionary containing the base64-encoded image of the meme.
@@ -493,22 +2513,10 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['Captcha'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Captcha meme creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_did_you_mean_meme(self, text, text_bottom):
-        """
+        """)
+
+    create_did_you_mean_meme = _endpoint('IMAGES', 'DidYouMean', 'Did you mean meme creation', ['text', 'text_bottom'],
+                                         doc="""
         Creates a "Did you mean?" meme.
         :param text: The main text to display on the meme.
         :param text_bottom: The bottom text to display on the meme.
@@ -520,22 +2528,9 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['DidYouMean'],
-                json={'text': text, 'text_bottom': text_bottom},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Did you mean meme creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_facts_meme(self, text):
-        """
+        """)
+
+    create_facts_meme = _endpoint('IMAGES', 'Facts', 'Facts meme creation', ['text'], doc="""
         Creates a "Facts" meme.
         :param text: The text to display on the meme.
         :return: A dictionary containing the base64-encoded image of the meme.
@@ -546,22 +2541,10 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['Facts'],
-                json={'text': text},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.HTTPError as http_err:
-            raise Exception(f"Facts meme creation request failed: {http_err}")
-        except Exception as err:
-            raise Exception(f"An error occurred: {err}")
-        
-    def create_pornhub_brand_meme(self, text, text_right):
-        """
+        """)
+
+    create_pornhub_brand_meme = _endpoint('IMAGES', 'PornHubBrand', 'PornHub Brand meme creation', ['text', 'text_right'],
+                                          doc="""
         Creates a "PornHub Brand" meme.
         :param text: The first text to use.
         :param text_right: The second text to use.
@@ -573,20 +2556,10 @@ class Freejourney:
 
         print(result['base64'])
         # Output: "iVBORw0KGgoAAAANSUhEUgAAA..."
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['PornHubBrand'],
-                json={'text': text, 'text_right': text_right},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            return response.json()['data']
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"PornHub Brand meme creation request failed: {e}")   
-        
-    def search_midjourney_images(self, query, number):
-        """
+        """)
+
+    search_midjourney_images = _endpoint('IMAGES', 'Midjourney', 'Midjourney image search', ['query', 'number'],
+                                         check_success=True, doc="""
         Searches for images created with the Midjourney bot.
         :param query: The text to use for the search.
         :param number: The number of images to return; can only be 1 or 4.
@@ -601,24 +2574,28 @@ class Freejourney:
             # Output: "data:image/png;base64,/9j/4AAQSkZJRgABAQEAAAAAAAD......"
         else:
             print("No result found.")
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['Midjourney'],
-                json={'query': query, 'number': number},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            data = response.json()
-            if data.get('success'):
-                return data.get('data', {})
-            else:
-                raise Exception(f"Midjourney image search failed: {data.get('message')}")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Midjourney image search request failed: {e}")
-        
-    def search_dalle_images(self, query, number):
-        """
+        """)
+
+    search_nijijourney_images = _endpoint('IMAGES', 'Nijijourney', 'Nijijourney image search', ['query', 'number'],
+                                          check_success=True, doc="""
+        Searches for images created with the Nijijourney bot.
+        :param query: The text to use for the search.
+        :param number: The number of images to return; can only be 1 or 4.
+        :return: A dictionary containing the base64-encoded image(s) of the search result.
+        :example:
+        # Usage example:
+        freejourney = Freejourney("<your_token_here>")
+        result = freejourney.search_nijijourney_images("Batman", 1)
+
+        if 'base64' in result:
+            print(result['base64'])
+            # Output: "data:image/png;base64,/9j/4AAQSkZJRgABAQEAAAAAAAD......"
+        else:
+            print("No result found.")
+        """)
+
+    search_dalle_images = _endpoint('IMAGES', 'DALLE', 'DALL-E image search', ['query', 'number'],
+                                    check_success=True, doc="""
         Searches for images created with DALL-E.
         :param query: The text to use for the search.
         :param number: The number of images to return; can only be 1 or 4.
@@ -633,24 +2610,10 @@ class Freejourney:
             # Output: "data:image/png;base64,/9j/4AAQSkZJRgABAQEAAAAAAAD......"
         else:
             print("No result found.")
-        """
-        try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['DALLE'],
-                json={'query': query, 'number': number},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            data = response.json()
-            if data.get('success'):
-                return data.get('data', {})
-            else:
-                raise Exception(f"DALL-E image search failed: {data.get('message')}")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"DALL-E image search request failed: {e}")
-        
-    def search_stable_diffusion_images(self, query, number):
-        """
+        """)
+
+    search_stable_diffusion_images = _endpoint('IMAGES', 'STABLE_DIFFUSION', 'Stable Diffusion image search', ['query', 'number'],
+                                               check_success=True, doc="""
         Searches for images created with Stable Diffusion.
         :param query: The text to use for the search.
         :param number: The number of images to return; can only be 1 or 4.
@@ -665,18 +2628,1120 @@ class Freejourney:
             # Output: "data:image/png;base64,/9j/4AAQSkZJRgABAQEAAAAAAAD......"
         else:
             print("No result found.")
+        """)
+
+    def chat_stream(self, prompt, model='chat_gpt4'):
+        """
+        Creates a chat completion and yields it piece by piece as the server sends it.
+        The request asks for a text/event-stream response; if the server answers with a regular JSON body instead,
+        the whole completion is yielded as a single chunk.
+        :param prompt: The text prompt to send.
+        :param model: One of CHAT_MODELS, or 'character:<model_id>' for a character model.
+        :return: A generator of completion text chunks.
+        :example:
+        # Usage example:
+        freejourney = Freejourney("<your_token_here>")
+        for chunk in freejourney.chat_stream("Tell me a story.", model='gemini'):
+            print(chunk, end='', flush=True)
+        """
+        name, label, payload = self._chat_request(model, prompt)
+        with self._stream('CHAT_COMPLETION', name, label, payload, accept='text/event-stream') as response:
+            if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                yield self._parse(response.content, label, False)['completion']
+                return
+            for line in response.iter_lines():
+                done, chunk = self._stream_event(line)
+                if done:
+                    return
+                if chunk:
+                    yield chunk
+
+    def stream_search_images(self, query, number, endpoint='search_midjourney_images'):
+        """
+        Searches for images and yields each one, decoded, as soon as it has been received, without buffering the
+        whole response: memory use is bounded by the size of a single image.
+        :param query: The text to use for the search.
+        :param number: The number of images to return; can only be 1 or 4.
+        :param endpoint: The search method to use, e.g. 'search_dalle_images'.
+        :return: A generator of decoded images, as bytearrays.
+        :example:
+        # Usage example:
+        freejourney = Freejourney("<your_token_here>")
+        for index, image in enumerate(freejourney.stream_search_images("Batman", 4, endpoint='search_dalle_images')):
+            with open(f"batman_{index}.png", 'wb') as f:
+                f.write(image)
+        """
+        group, name, label, payload = self._search_request(endpoint, query, number)
+        parser = ImageStreamParser()
+        with self._stream(group, name, label, payload) as response:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                yield from parser.feed(chunk)
+        parser.close(label)
+
+    @contextlib.contextmanager
+    def _stream(self, group, name, label, payload, accept=None):
+        """
+        Opens a streaming request, honouring the rate limits and raising FreejourneyError on failure, including
+        failures while the body is being read.
+        :param accept: The value of the Accept header, if any.
+        :return: A context manager yielding the response.
         """
+        delay = self._rate_limit_delay(group)
+        if delay > 0:
+            time.sleep(delay)
+        ticket = self._schedule(group, name, label, None)
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        throttled = retry_after = status = backend = response = None
+        failed = False
         try:
-            response = requests.post(
-                self.endpoints['BASE'] + self.endpoints['IMAGES']['STABLE_DIFFUSION'],
-                json={'query': query, 'number': number},
-                headers={'X-Freejourney-Key': self.token}
-            )
-            response.raise_for_status()
-            data = response.json()
-            if data.get('success'):
-                return data.get('data', {})
+            started = time.perf_counter()
+            backend, url, headers = self._route(group, name)
+            body, headers, _ = self._encode(url, payload, headers, compress=False)
+            if accept:
+                headers = dict(headers, Accept=accept)
+            with self.session.post(url, data=body, headers=headers, stream=True,
+                                   timeout=(self.timeout.connect, self.timeout.read)) as response:
+                status = response.status_code
+                if response.status_code == 429:
+                    throttled = True
+                    retry_after = self._throttled(group, response.headers.get('Retry-After'))
+                response.raise_for_status()
+                if self.metrics is not None:
+                    response.iter_content = self._counting(response.iter_content)
+                yield response
+        except FreejourneyError:
+            raise
+        except requests.exceptions.HTTPError as http_err:
+            failed = True
+            error = RateLimitError if throttled else FreejourneyError
+            raise error(f"{label} request failed: {http_err}", http_err.response.status_code, retry_after)
+        except Exception as err:
+            failed = True
+            status = None
+            raise FreejourneyError(f"An error occurred: {err}")
+        finally:
+            if self.metrics is not None and (failed or response is not None):
+                self._count_stream(name, started, failed, status, response)
+            if backend is not None:
+                self.load_balancer.release(backend, time.perf_counter() - started, status, retry_after)
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            if self.concurrency is not None:
+                self.concurrency.release(self._outcome(status))
+
+    def _count_stream(self, name, started, failed, status, response):
+        """
+        Records the metrics of a streaming request once its response has been read, or once it failed.
+        :param response: The response, or None if none was received.
+        """
+        self.metrics.increment(name, 'requests')
+        if response is not None:
+            self.metrics.observe(name, 'ttfb', response.elapsed.total_seconds())
+        if failed:
+            self.metrics.error(name, status)
+            return
+        self.metrics.observe(name, 'total', time.perf_counter() - started)
+        self.metrics.increment(name, 'bytes_sent', len(response.request.body or b''))
+        # The raw stream counts the bytes read before decompression, except for chunked responses.
+        received = response.raw.tell() or getattr(response.iter_content, 'received', [0])[0]
+        self._count_received(name, response.headers, b'', received)
+
+    @staticmethod
+    def _counting(iter_content):
+        """
+        Wraps Response.iter_content, which iter_lines uses too, to count the bytes it yields in its 'received' list.
+        """
+        received = [0]
+
+        def counting(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                received[0] += len(chunk)
+                yield chunk
+
+        counting.received = received
+        return counting
+
+    @staticmethod
+    def _search_request(endpoint, query, number):
+        """
+        Resolves an image search method name to its endpoint.
+        :return: The endpoint group, name and error label, and the JSON body of the request.
+        """
+        declaration = ENDPOINTS.get(endpoint)
+        if declaration is None or not endpoint.startswith('search_'):
+            raise ValueError(f"Unknown image search endpoint: {endpoint}")
+        return declaration.group, declaration.name, declaration.label, {'query': query, 'number': number}
+
+    @staticmethod
+    def _chat_request(model, prompt):
+        """
+        Resolves a chat model name to its endpoint.
+        :return: The endpoint name, the error label and the JSON body of the request.
+        """
+        if model.startswith('character:'):
+            return 'Characters', 'Character model', {'prompt': prompt, 'model': model.split(':', 1)[1]}
+        if model not in CHAT_MODELS:
+            raise ValueError(f"Unknown chat model: {model}")
+        endpoint = ENDPOINTS[model]
+        return endpoint.name, endpoint.label, {'prompt': prompt}
+
+    @staticmethod
+    def _stream_event(line):
+        """
+        Parses one line of a server-sent event stream.
+        :return: Whether the stream is finished, and the completion text carried by the line, if any.
+        """
+        if not line.startswith(b'data:'):
+            return False, None
+        line = line[5:].strip()
+        if line == b'[DONE]':
+            return True, None
+        event = json.loads(line)
+        if isinstance(event, str):
+            return False, event
+        return False, event.get('completion', event.get('data', {}).get('completion'))
+
+    def _chat_method(self, model):
+        """
+        Resolves a batch model name to a bound method taking a single prompt.
+        :param model: One of CHAT_MODELS, or 'character:<model_id>' for a character model.
+        :return: A callable sending a prompt to the model.
+        """
+        if model.startswith('character:'):
+            character_id = model.split(':', 1)[1]
+            return lambda prompt: self.character(character_id, prompt)
+        if model not in CHAT_MODELS:
+            raise ValueError(f"Unknown chat model: {model}")
+        return getattr(self, model)
+
+    def _batch_jobs(self, prompts, models):
+        """
+        Resolves every model once, up front, so that an unknown one fails the batch before any request is sent.
+        :return: A generator of (index, prompt, model, method) jobs, consuming prompts lazily.
+        """
+        methods = [(model, self._chat_method(model)) for model in models]
+        jobs = ((prompt, model, method) for prompt in prompts for model, method in methods)
+        return ((index, *job) for index, job in enumerate(jobs))
+
+    def _batch_item(self, index, prompt, model, method):
+        try:
+            return BatchResult(index, prompt, model, method(prompt), None)
+        except Exception as err:
+            return BatchResult(index, prompt, model, None, err)
+
+    def batch_chat(self, prompts, models=('chat_gpt3_5_turbo',), max_concurrency=8, ordered=True):
+        """
+        Sends every prompt to every model in parallel and yields the results as they arrive.
+        Failed items are reported through BatchResult.error instead of aborting the batch.
+        Keep pool_maxsize at least as large as max_concurrency so every worker gets a pooled connection.
+        :param prompts: An iterable of text prompts; it is consumed lazily.
+        :param models: The models to send each prompt to; see CHAT_MODELS, or 'character:<model_id>'.
+        :param max_concurrency: The maximum number of requests in flight at once.
+        :param ordered: Whether to yield results in submission order rather than as they complete.
+        :return: A generator of BatchResult.
+        :example:
+        # Usage example:
+        freejourney = Freejourney("<your_token_here>")
+        for item in freejourney.batch_chat(["What is 1 + 1?"], models=CHAT_MODELS, ordered=False):
+            print(item.model, item.error or item.result['completion'])
+        """
+        jobs = self._batch_jobs(prompts, models)
+        window = max_concurrency * 2
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            pending = deque() if ordered else set()
+            submit = pending.append if ordered else pending.add
+            for job in jobs:
+                submit(executor.submit(self._batch_item, *job))
+                if len(pending) < window:
+                    continue
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    submit = pending.add
+                    for future in done:
+                        yield future.result()
+            if ordered:
+                while pending:
+                    yield pending.popleft().result()
             else:
-                raise Exception(f"Stable Diffusion image search failed: {data.get('message')}")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Stable Diffusion image search request failed: {e}")
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+# Registry of every endpoint method, keyed by method name.
+ENDPOINTS = {}
+for _name, _method in list(vars(Freejourney).items()):
+    if hasattr(_method, 'endpoint'):
+        _method.__name__ = _name
+        _method.__qualname__ = f"Freejourney.{_name}"
+        ENDPOINTS[_name] = _method.endpoint
+del _name, _method
+
+class AsyncFreejourney(Freejourney):
+    """
+    Asyncio counterpart of Freejourney, backed by a pooled aiohttp session.
+    Every endpoint method has the same signature as on Freejourney but returns a coroutine.
+    :example:
+    # Usage example:
+    async with AsyncFreejourney("<your_token_here>", max_concurrency=200) as freejourney:
+        results = await asyncio.gather(*(freejourney.chat_gpt4(p) for p in prompts))
+    """
+    def __init__(self, token, max_concurrency=100, pool_maxsize=100, keep_alive=True, idle_timeout=15, **options):
+        """
+        Creates an instance of AsyncFreejourney.
+        :param token: The token to use for all further requests, or a list of tokens to spread requests over.
+        :param max_concurrency: The maximum number of requests this instance keeps in flight at once.
+        :param pool_maxsize: The maximum number of connections kept open to a single host.
+        :param keep_alive: Whether connections are kept open and reused between requests.
+        :param idle_timeout: Seconds after which idle pooled connections are dropped.
+        :param options: Any other keyword argument accepted by Freejourney, e.g. cache.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncFreejourney requires the 'aiohttp' package.")
+        if options.get('transport') is not None:
+            raise TypeError("AsyncFreejourney sends requests with aiohttp and does not support transport adapters.")
+        # The session and the asyncio primitives belong to the event loop they are used in. They are held in a dict
+        # so that copies made by with_options share them, and are created again when the loop changes; see _bind_loop.
+        self._loop_state = {'loop': None, 'session': None, 'semaphore': None, 'concurrency_changed': None}
+        self.max_concurrency = max_concurrency
+        super().__init__(token, pool_maxsize=pool_maxsize, keep_alive=keep_alive, idle_timeout=idle_timeout,
+                         **options)
+
+    def _create_session(self, pool_connections, pool_maxsize, keep_alive):
+        # The aiohttp session has to be created from inside the running event loop; see _get_session.
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        return None
+
+    @property
+    def session(self):
+        return self._loop_state['session']
+
+    @session.setter
+    def session(self, session):
+        if session is not None:
+            self._loop_state['session'] = session
+
+    @property
+    def _semaphore(self):
+        return self._loop_state['semaphore']
+
+    @property
+    def _concurrency_changed(self):
+        return self._loop_state['concurrency_changed']
+
+    async def _bind_loop(self):
+        """
+        Binds this instance to the running event loop, e.g. on each asyncio.run(). The session of a previous loop
+        is closed and the semaphore and condition are created again, as they cannot be used from another loop.
+        :raises RuntimeError: If the previous loop is still running, or the session was passed in by the caller.
+        """
+        loop = asyncio.get_running_loop()
+        state = self._loop_state
+        if state['loop'] is loop:
+            return
+        if state['loop'] is not None and state['loop'].is_running():
+            raise RuntimeError("AsyncFreejourney is already in use by another running event loop.")
+        session = state['session']
+        if state['loop'] is not None and session is not None and not session.closed:
+            if not self._owns_session:
+                raise RuntimeError("The session given to AsyncFreejourney belongs to another event loop; "
+                                   "pass a session created in the running loop.")
+            state['session'] = None
+            await session.close()
+        state['loop'] = loop
+        state['semaphore'] = asyncio.Semaphore(self.max_concurrency)
+        state['concurrency_changed'] = asyncio.Condition()
+        # Calls left over from the previous loop can no longer be awaited.
+        self._in_flight.clear()
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with AsyncFreejourney.")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes all pooled connections held by this instance.
+        """
+        if self.session is not None and self._owns_session:
+            await self.session.close()
+            self._loop_state['session'] = None
+        if self._owns_load_balancer and self.load_balancer is not None:
+            self.load_balancer.close()
+
+    def _get_session(self):
+        # The session has to be created from inside the running event loop.
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                             limit_per_host=self.pool_maxsize,
+                                             force_close=not self.keep_alive,
+                                             keepalive_timeout=self.idle_timeout if self.keep_alive else None)
+            trace_configs = [self._trace_config()] if self.metrics is not None else None
+            self.session = aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+        return self.session
+
+    def _trace_config(self):
+        """
+        Builds the aiohttp tracing hooks recording the DNS, connect, TTFB and bytes sent metrics.
+        """
+        metrics = self.metrics
+        trace = aiohttp.TraceConfig()
+
+        def endpoint(context):
+            return (context.trace_request_ctx or {}).get('endpoint')
+
+        async def request_start(session, context, params):
+            context.started = time.perf_counter()
+            context.sent = 0
+
+        async def chunk_sent(session, context, params):
+            context.sent += len(params.chunk)
+
+        async def headers_received(session, context, params):
+            if endpoint(context) is not None:
+                metrics.observe(endpoint(context), 'ttfb', time.perf_counter() - context.started)
+                metrics.increment(endpoint(context), 'bytes_sent', context.sent)
+
+        async def phase_start(session, context, params):
+            context.phase_started = time.perf_counter()
+
+        def phase_end(phase):
+            async def end(session, context, params):
+                if endpoint(context) is not None:
+                    metrics.observe(endpoint(context), phase, time.perf_counter() - context.phase_started)
+            return end
+
+        trace.on_request_start.append(request_start)
+        trace.on_request_chunk_sent.append(chunk_sent)
+        trace.on_request_end.append(headers_received)
+        trace.on_dns_resolvehost_start.append(phase_start)
+        trace.on_dns_resolvehost_end.append(phase_end('dns'))
+        trace.on_connection_create_start.append(phase_start)
+        trace.on_connection_create_end.append(phase_end('connect'))
+        return trace
+
+    async def _call(self, method, group, name, label, payload=None, check_success=False):
+        """
+        Sends a request to an endpoint over the pooled session.
+        :param method: The HTTP method to use.
+        :param group: The endpoint group in endpoints.json, e.g. 'IMAGES'.
+        :param name: The endpoint name within the group, e.g. 'QRCode'.
+        :param label: The name used in error messages.
+        :param payload: The JSON body to send, if any.
+        :param check_success: Whether to raise when the response's 'success' flag is not set.
+        :return: The 'data' field of the response.
+        """
+        await self._bind_loop()
+        key = self._request_key(name, payload)
+        content = self.cache.get(key) if key is not None and self.cache is not None else None
+        namespace = self._semantic_namespace(group, name, payload)
+        if content is None and namespace is not None:
+            content = self.semantic_cache.get(namespace, payload['prompt'])
+        if content is not None:
+            if self.metrics is not None:
+                self.metrics.increment(name, 'cache_hits')
+            return self._result(group, name, self._parse(content, label, check_success))
+        if key is not None and self.coalesce:
+            content = await self._fetch_shared(key, method, group, name, label, payload)
+        else:
+            content = await self._fetch(method, group, name, label, payload)
+        data = self._parse(content, label, check_success)
+        if key is not None and self.cache is not None:
+            self.cache.set(key, content, self.cache_ttls.get(name, self.cache_ttl))
+        if namespace is not None:
+            self.semantic_cache.set(namespace, payload['prompt'], content)
+        return self._result(group, name, data)
+
+    async def _fetch_shared(self, key, method, group, name, label, payload):
+        """
+        Performs a call, or waits for an identical call already in flight in another task and shares its response.
+        The call runs in its own task, so that cancelling one waiter does not cancel it for the others.
+        :return: The raw response body.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._fetch(method, group, name, label, payload))
+            task.add_done_callback(functools.partial(self._call_done, key))
+        elif self.metrics is not None:
+            self.metrics.increment(name, 'coalesced')
+        return await asyncio.shield(task)
+
+    def _call_done(self, key, task):
+        del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter was cancelled.
+            task.exception()
+
+    async def _fetch(self, method, group, name, label, payload):
+        """
+        Performs a call, retrying and hedging it as configured.
+        :return: The raw response body.
+        """
+        deadline = time.monotonic() + self.timeout.total if self.timeout.total is not None else None
+        attempt = 1
+        while True:
+            try:
+                if self.hedge_after is not None and name in self.hedged_endpoints:
+                    return await self._send_hedged(method, group, name, label, payload, deadline)
+                return await self._send(method, group, name, label, payload, deadline)
+            except FreejourneyError as err:
+                delay = self._retry_delay(attempt, err, name, label, deadline)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send_hedged(self, method, group, name, label, payload, deadline):
+        """
+        Sends a request and, if it has not completed after hedge_after seconds, an identical one.
+        :return: The raw response body of whichever request succeeds first.
+        """
+        args = (method, group, name, label, payload, deadline)
+        pending = {asyncio.ensure_future(self._send(*args))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if not done:
+                pending.add(asyncio.ensure_future(self._send(*args)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _send(self, method, group, name, label, payload, deadline=None):
+        """
+        Performs a single HTTP request, honouring the rate limits and the concurrency governor.
+        :return: The raw response body.
+        """
+        delay = self._rate_limit_delay(group)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        remaining = self._remaining(label, deadline)
+        ticket = await self._schedule(group, name, label, remaining)
+        if ticket is not None and deadline is not None:
+            # Leave out the time spent waiting for the scheduler; aiohttp reads a zero timeout as none.
+            remaining = max(deadline - time.monotonic(), 0.001)
+        timeout = aiohttp.ClientTimeout(total=remaining, connect=self.timeout.connect, sock_read=self.timeout.read)
+        if self.concurrency is not None:
+            try:
+                async with self._concurrency_changed:
+                    await self._concurrency_changed.wait_for(self.concurrency.try_acquire)
+            except asyncio.CancelledError:
+                if ticket is not None:
+                    self.scheduler.release(ticket)
+                raise
+        metrics = self.metrics
+        retry_after = throttled = status = backend = None
+        try:
+            async with self._semaphore:
+                backend, url, headers = self._route(group, name)
+                started = time.perf_counter() if metrics is not None or backend is not None else None
+                body, request_headers, saved = self._encode(url, payload, headers)
+                while True:
+                    async with self._get_session().request(method, url, data=body, headers=request_headers,
+                                                           timeout=timeout,
+                                                           trace_request_ctx={'endpoint': name}) as response:
+                        if self._rejected_compression(url, response.status, request_headers):
+                            body, request_headers, saved = self._encode(url, payload, headers, compress=False)
+                            continue
+                        status = response.status
+                        if response.status == 429:
+                            throttled = True
+                            retry_after = self._throttled(group, response.headers.get('Retry-After'))
+                        response.raise_for_status()
+                        content = await response.read()
+                        response_headers = response.headers
+                    break
+            if metrics is not None:
+                metrics.observe(name, 'total', time.perf_counter() - started)
+                metrics.increment(name, 'requests')
+                self._count_received(name, response_headers, content, saved=saved)
+            return content
+        except aiohttp.ClientResponseError as http_err:
+            if metrics is not None:
+                metrics.increment(name, 'requests')
+                metrics.error(name, http_err.status)
+            error = RateLimitError if throttled else FreejourneyError
+            raise error(f"{label} request failed: {http_err}", http_err.status, retry_after)
+        except Exception as err:
+            # The body may have failed to arrive after the status did.
+            status = None
+            if metrics is not None:
+                metrics.increment(name, 'requests')
+                metrics.error(name, None)
+            # Timeouts carry no message of their own.
+            raise FreejourneyError(f"An error occurred: {str(err) or type(err).__name__}")
+        finally:
+            if backend is not None:
+                self.load_balancer.release(backend, time.perf_counter() - started, status, retry_after)
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            if self.concurrency is not None:
+                self.concurrency.release(self._outcome(status))
+                async with self._concurrency_changed:
+                    self._concurrency_changed.notify_all()
+
+    async def _schedule(self, group, name, label, timeout):
+        if self.scheduler is None:
+            return None
+        ticket = await self.scheduler.acquire_async(group, name, timeout)
+        if ticket is None:
+            raise FreejourneyError(f"{label} request failed: deadline exceeded")
+        if self.metrics is not None:
+            self.metrics.observe(name, 'queue_wait', ticket.waited)
+        return ticket
+
+    async def filter_text(self, text, fill='*'):
+        """
+        Filters a text, replacing all moderated words by * or a specified character.
+        With a text_filter, texts without any moderated word are returned unchanged without sending a request.
+        :param text: The text to filter.
+        :param fill: The character to use to replace moderated words. Accepted characters: _ ~ - = | *
+        :return: A dictionary containing the original text and the filtered result.
+        """
+        result = self._filter_locally(text, fill)
+        if result is not None:
+            return result
+        return await self._call('POST', 'MODERATION', 'TextFilter', 'Text filtering', {'text': text, 'fill': fill})
+
+    async def chat_stream(self, prompt, model='chat_gpt4'):
+        """
+        Creates a chat completion and yields it piece by piece as the server sends it.
+        The request asks for a text/event-stream response; if the server answers with a regular JSON body instead,
+        the whole completion is yielded as a single chunk.
+        :param prompt: The text prompt to send.
+        :param model: One of CHAT_MODELS, or 'character:<model_id>' for a character model.
+        :return: An async generator of completion text chunks.
+        :example:
+        # Usage example:
+        async with AsyncFreejourney("<your_token_here>") as freejourney:
+            async for chunk in freejourney.chat_stream("Tell me a story.", model='gemini'):
+                print(chunk, end='', flush=True)
+        """
+        name, label, payload = self._chat_request(model, prompt)
+        async with self._stream('CHAT_COMPLETION', name, label, payload, accept='text/event-stream') as response:
+            if not response.content_type.startswith('text/event-stream'):
+                yield self._parse(await response.read(), label, False)['completion']
+                return
+            async for line in response.content:
+                done, chunk = self._stream_event(line.rstrip(b'\r\n'))
+                if done:
+                    return
+                if chunk:
+                    yield chunk
+
+    async def stream_search_images(self, query, number, endpoint='search_midjourney_images'):
+        """
+        Searches for images and yields each one, decoded, as soon as it has been received, without buffering the
+        whole response: memory use is bounded by the size of a single image.
+        :param query: The text to use for the search.
+        :param number: The number of images to return; can only be 1 or 4.
+        :param endpoint: The search method to use, e.g. 'search_dalle_images'.
+        :return: An async generator of decoded images, as bytearrays.
+        :example:
+        # Usage example:
+        async with AsyncFreejourney("<your_token_here>") as freejourney:
+            async for image in freejourney.stream_search_images("Batman", 4):
+                process(image)
+        """
+        group, name, label, payload = self._search_request(endpoint, query, number)
+        parser = ImageStreamParser()
+        async with self._stream(group, name, label, payload) as response:
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                for image in parser.feed(chunk):
+                    yield image
+        parser.close(label)
+
+    @contextlib.asynccontextmanager
+    async def _stream(self, group, name, label, payload, accept=None):
+        """
+        Opens a streaming request, honouring the rate limits and raising FreejourneyError on failure, including
+        failures while the body is being read.
+        :param accept: The value of the Accept header, if any.
+        :return: An async context manager yielding the response.
+        """
+        await self._bind_loop()
+        delay = self._rate_limit_delay(group)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        timeout = aiohttp.ClientTimeout(connect=self.timeout.connect, sock_read=self.timeout.read)
+        throttled = retry_after = status = backend = response = None
+        failed = False
+        ticket = await self._schedule(group, name, label, None)
+        if self.concurrency is not None:
+            try:
+                async with self._concurrency_changed:
+                    await self._concurrency_changed.wait_for(self.concurrency.try_acquire)
+            except asyncio.CancelledError:
+                if ticket is not None:
+                    self.scheduler.release(ticket)
+                raise
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                backend, url, headers = self._route(group, name)
+                body, headers, _ = self._encode(url, payload, headers, compress=False)
+                if accept:
+                    headers = dict(headers, Accept=accept)
+                async with self._get_session().post(url, data=body, headers=headers, timeout=timeout,
+                                                    trace_request_ctx={'endpoint': name}) as response:
+                    status = response.status
+                    if response.status == 429:
+                        throttled = True
+                        retry_after = self._throttled(group, response.headers.get('Retry-After'))
+                    response.raise_for_status()
+                    yield response
+        except FreejourneyError:
+            raise
+        except aiohttp.ClientResponseError as http_err:
+            failed = True
+            error = RateLimitError if throttled else FreejourneyError
+            raise error(f"{label} request failed: {http_err}", http_err.status, retry_after)
+        except Exception as err:
+            failed = True
+            status = None
+            raise FreejourneyError(f"An error occurred: {str(err) or type(err).__name__}")
+        finally:
+            if self.metrics is not None and (failed or response is not None):
+                self._count_stream(name, started, failed, status, response)
+            if backend is not None:
+                self.load_balancer.release(backend, time.perf_counter() - started, status, retry_after)
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            if self.concurrency is not None:
+                self.concurrency.release(self._outcome(status))
+                async with self._concurrency_changed:
+                    self._concurrency_changed.notify_all()
+
+    def _count_stream(self, name, started, failed, status, response):
+        # The tracing hooks record the TTFB and the bytes sent.
+        self.metrics.increment(name, 'requests')
+        if failed:
+            self.metrics.error(name, status)
+            return
+        self.metrics.observe(name, 'total', time.perf_counter() - started)
+        self._count_received(name, response.headers, b'', response.content.total_bytes)
+
+    async def _batch_item(self, index, prompt, model, method):
+        try:
+            return BatchResult(index, prompt, model, await method(prompt), None)
+        except Exception as err:
+            return BatchResult(index, prompt, model, None, err)
+
+    async def batch_chat(self, prompts, models=('chat_gpt3_5_turbo',), max_concurrency=8, ordered=True):
+        """
+        Sends every prompt to every model concurrently and yields the results as they arrive.
+        Failed items are reported through BatchResult.error instead of aborting the batch.
+        :param prompts: An iterable of text prompts; it is consumed lazily.
+        :param models: The models to send each prompt to; see CHAT_MODELS, or 'character:<model_id>'.
+        :param max_concurrency: The maximum number of requests in flight at once for this batch.
+        :param ordered: Whether to yield results in submission order rather than as they complete.
+        :return: An async generator of BatchResult.
+        :example:
+        # Usage example:
+        async with AsyncFreejourney("<your_token_here>") as freejourney:
+            async for item in freejourney.batch_chat(prompts, models=CHAT_MODELS, ordered=False):
+                print(item.model, item.error or item.result['completion'])
+        """
+        jobs = self._batch_jobs(prompts, models)
+        pending = deque() if ordered else set()
+        try:
+            for job in jobs:
+                task = asyncio.ensure_future(self._batch_item(*job))
+                if ordered:
+                    pending.append(task)
+                    if len(pending) >= max_concurrency:
+                        yield await pending.popleft()
+                else:
+                    pending.add(task)
+                    if len(pending) >= max_concurrency:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            yield task.result()
+            while pending:
+                if ordered:
+                    yield await pending.popleft()
+                else:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+class ChatSession:
+    """
+    Multi-turn conversation on top of a chat model, which only accepts a single prompt per request.
+    The history is kept as rendered turns with approximate token counts, and old turns are dropped, or summarized
+    by the model, so that every prompt fits the model's context window.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>")
+    session = ChatSession(freejourney, model='chat_gpt3_5_turbo_16k', system="You are a helpful assistant.")
+
+    print(session.send("My name is Ada."))
+    print(session.send("What is my name?"))
+    # Output: "Your name is Ada."
+    """
+    # Rough average of characters per token for English text.
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, client, model='chat_gpt3_5_turbo', system=None, context_window=None, reserve_tokens=1024,
+                 summarize=False):
+        """
+        Creates an instance of ChatSession.
+        :param client: The Freejourney instance to send requests with.
+        :param model: One of CHAT_MODELS, or 'character:<model_id>' for a character model.
+        :param system: Instructions kept at the top of every prompt.
+        :param context_window: The model's context window in tokens; defaults to CONTEXT_WINDOWS.
+        :param reserve_tokens: Tokens left free for the completion.
+        :param summarize: Whether dropped turns are replaced by a summary written by the model.
+        """
+        self.client = client
+        self.model = model
+        self._complete = client._chat_method(model)
+        if context_window is None:
+            context_window = CONTEXT_WINDOWS['character' if model.startswith('character:') else model]
+        self.budget = context_window - reserve_tokens
+        self.summarize = summarize
+        self.system = self._turn('System', system) if system else None
+        self.summary = None
+        self.turns = deque()
+        self.tokens = self.system[1] if self.system else 0
+
+    @classmethod
+    def count_tokens(cls, text):
+        """
+        Returns an approximate number of tokens for a text.
+        """
+        return len(text) // cls.CHARS_PER_TOKEN + 1
+
+    def _turn(self, role, text):
+        rendered = f"{role}: {text}\n"
+        return rendered, self.count_tokens(rendered)
+
+    def reset(self):
+        """
+        Forgets the conversation, keeping the system instructions.
+        """
+        self.summary = None
+        self.turns.clear()
+        self.tokens = self.system[1] if self.system else 0
+
+    def _prompt(self, message):
+        """
+        Renders the prompt for a new message, leaving out the oldest turns if needed to fit the context window.
+        The history itself is only changed by _record, once the requests have succeeded.
+        :return: The prompt, the rendered user turn, and the turns left out, preceded by the previous summary if it
+            has to be folded into a new one.
+        :raises ValueError: If the message alone does not fit the context window.
+        """
+        user = self._turn('User', message)
+        available = self.budget - (self.system[1] if self.system else 0)
+        if user[1] > available:
+            raise ValueError(f"The message takes about {user[1]} tokens, more than the {available} the context "
+                             f"window leaves for it")
+        tokens = self.tokens
+        dropped = []
+        for turn in self.turns:
+            if tokens + user[1] <= self.budget:
+                break
+            tokens -= turn[1]
+            dropped.append(turn)
+        kept = list(self.turns)[len(dropped):]
+        summary = self.summary
+        if dropped and summary is not None:
+            # The previous summary is folded into the next one.
+            dropped.insert(0, summary)
+            summary = None
+        parts = [turn[0] for turn in (self.system, summary) if turn is not None]
+        parts.extend(turn[0] for turn in kept)
+        parts.append(user[0])
+        parts.append("Assistant:")
+        return ''.join(parts), user, dropped
+
+    def _summary_prompt(self, dropped):
+        return ("Summarize the following conversation in a few sentences, keeping every fact needed to continue it:\n"
+                + ''.join(turn[0] for turn in dropped))
+
+    def _prompt_with_summary(self, prompt, summary):
+        """
+        Inserts a fresh summary right after the system instructions of a prompt built by _prompt.
+        """
+        system = self.system[0] if self.system else ''
+        return f"{system}Summary of the earlier conversation: {summary}\n{prompt[len(system):]}"
+
+    def _record(self, user, completion, dropped, summary=None):
+        """
+        Adds an exchange to the history, dropping the turns _prompt left out and storing the new summary, if any.
+        """
+        if dropped and dropped[0] is self.summary:
+            self.tokens -= self.summary[1]
+            self.summary = None
+            dropped = dropped[1:]
+        for turn in dropped:
+            self.turns.popleft()
+            self.tokens -= turn[1]
+        if summary is not None:
+            self.summary = self._turn('Summary of the earlier conversation', summary)
+            self.tokens += self.summary[1]
+        assistant = self._turn('Assistant', completion)
+        self.turns.append(user)
+        self.turns.append(assistant)
+        self.tokens += user[1] + assistant[1]
+
+    def send(self, message):
+        """
+        Sends a message in the conversation.
+        :param message: The user's message.
+        :return: The model's completion text.
+        """
+        prompt, user, dropped = self._prompt(message)
+        summary = None
+        if dropped and self.summarize:
+            summary = self._complete(self._summary_prompt(dropped))['completion']
+            prompt = self._prompt_with_summary(prompt, summary)
+        completion = self._complete(prompt)['completion']
+        self._record(user, completion, dropped, summary)
+        return completion
+
+class AsyncChatSession(ChatSession):
+    """
+    ChatSession for AsyncFreejourney; send() is a coroutine.
+    :example:
+    # Usage example:
+    async with AsyncFreejourney("<your_token_here>") as freejourney:
+        session = AsyncChatSession(freejourney, model='gemini')
+        print(await session.send("My name is Ada."))
+    """
+    async def send(self, message):
+        """
+        Sends a message in the conversation.
+        :param message: The user's message.
+        :return: The model's completion text.
+        """
+        prompt, user, dropped = self._prompt(message)
+        summary = None
+        if dropped and self.summarize:
+            summary = (await self._complete(self._summary_prompt(dropped)))['completion']
+            prompt = self._prompt_with_summary(prompt, summary)
+        completion = (await self._complete(prompt))['completion']
+        self._record(user, completion, dropped, summary)
+        return completion
+
+class Prefetcher:
+    """
+    Keeps random content fetched ahead of time, so that it is served from memory instead of a round trip.
+    A background thread per endpoint refills its buffer up to `size` items whenever it drops below `low_water`,
+    skipping items served or buffered recently. When a buffer runs dry, get() falls back to a direct request.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>")
+    with Prefetcher(freejourney, endpoints=('dad_joke', 'trivia'), size=20) as prefetcher:
+        print(prefetcher.get('dad_joke')['joke'])
+    """
+    # Consecutive duplicates after which an item is accepted anyway, for endpoints with few distinct items.
+    MAX_DUPLICATES = 3
+    # Longest pause, in seconds, between two refill attempts after failures.
+    MAX_BACKOFF = 30
+
+    def __init__(self, client, endpoints=RANDOM_ENDPOINTS, size=10, low_water=None, recent=256):
+        """
+        Creates an instance of Prefetcher and starts filling its buffers.
+        :param client: The Freejourney instance to send requests with.
+        :param endpoints: The methods to prefetch; see RANDOM_ENDPOINTS.
+        :param size: The number of items kept per endpoint.
+        :param low_water: The number of items under which a buffer is refilled; defaults to half of size.
+        :param recent: The number of recent items per endpoint that are not served again.
+        """
+        for endpoint in endpoints:
+            if endpoint not in RANDOM_ENDPOINTS:
+                raise ValueError(f"Not a random content endpoint: {endpoint}")
+        self.client = client
+        self.size = size
+        self.low_water = low_water if low_water is not None else max(1, size // 2)
+        self.recent = recent
+        self.buffers = {endpoint: deque() for endpoint in endpoints}
+        self._recent = {endpoint: OrderedDict() for endpoint in endpoints}
+        self.hits = 0
+        self.misses = 0
+        self._closed = False
+        self._start()
+
+    def _start(self):
+        self._condition = threading.Condition()
+        self._threads = [threading.Thread(target=self._refill, args=(endpoint,),
+                                          name=f"freejourney-prefetch-{endpoint}", daemon=True)
+                         for endpoint in self.buffers]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _key(item):
+        return json.dumps(item.to_dict() if isinstance(item, Result) else item, sort_keys=True)
+
+    def _remember(self, endpoint, key):
+        """
+        Records an item as recently seen.
+        :return: Whether it had already been seen.
+        """
+        recent = self._recent[endpoint]
+        seen = key in recent
+        recent[key] = None
+        recent.move_to_end(key)
+        while len(recent) > self.recent:
+            recent.popitem(last=False)
+        return seen
+
+    def _needs_refill(self, endpoint):
+        return len(self.buffers[endpoint]) < self.low_water
+
+    def _store(self, endpoint, item, duplicates):
+        """
+        Adds a fetched item to a buffer unless it was seen recently.
+        :return: The updated number of consecutive duplicates.
+        """
+        if self._remember(endpoint, self._key(item)) and duplicates < self.MAX_DUPLICATES:
+            return duplicates + 1
+        self.buffers[endpoint].append(item)
+        return 0
+
+    def _take(self, endpoint):
+        """
+        Pops an item from a buffer, or returns None if it is empty.
+        """
+        buffer = self.buffers[endpoint]
+        if not buffer:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return buffer.popleft()
+
+    def _refill(self, endpoint):
+        method = getattr(self.client, endpoint)
+        failures = duplicates = 0
+        while True:
+            with self._condition:
+                while not self._closed and not self._needs_refill(endpoint):
+                    self._condition.wait()
+                if self._closed:
+                    return
+            while len(self.buffers[endpoint]) < self.size and not self._closed:
+                try:
+                    item = method()
+                except Exception:
+                    failures += 1
+                    with self._condition:
+                        self._condition.wait(min(self.MAX_BACKOFF, 0.5 * 2 ** failures))
+                    continue
+                failures = 0
+                with self._condition:
+                    duplicates = self._store(endpoint, item, duplicates)
+
+    def get(self, endpoint):
+        """
+        Returns an item of an endpoint, from its buffer if possible.
+        :param endpoint: One of the prefetched methods, e.g. 'dad_joke'.
+        :return: The same dictionary the method returns.
+        """
+        with self._condition:
+            item = self._take(endpoint)
+            if self._needs_refill(endpoint):
+                self._condition.notify_all()
+        if item is not None:
+            return item
+        item = getattr(self.client, endpoint)()
+        with self._condition:
+            self._remember(endpoint, self._key(item))
+        return item
+
+    def close(self):
+        """
+        Stops the background refills; the client is left open.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+class AsyncPrefetcher(Prefetcher):
+    """
+    Prefetcher for AsyncFreejourney, refilling its buffers from tasks; get() and close() are coroutines.
+    It must be created, or entered, from inside the running event loop.
+    :example:
+    # Usage example:
+    async with AsyncFreejourney("<your_token_here>") as freejourney:
+        async with AsyncPrefetcher(freejourney) as prefetcher:
+            print((await prefetcher.get('cat_fact'))['fact'])
+    """
+    def _start(self):
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.ensure_future(self._refill(endpoint)) for endpoint in self.buffers]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _refill(self, endpoint):
+        method = getattr(self.client, endpoint)
+        failures = duplicates = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._closed or self._needs_refill(endpoint))
+                if self._closed:
+                    return
+            while len(self.buffers[endpoint]) < self.size and not self._closed:
+                try:
+                    item = await method()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    failures += 1
+                    await asyncio.sleep(min(self.MAX_BACKOFF, 0.5 * 2 ** failures))
+                    continue
+                failures = 0
+                duplicates = self._store(endpoint, item, duplicates)
+
+    async def get(self, endpoint):
+        """
+        Returns an item of an endpoint, from its buffer if possible.
+        :param endpoint: One of the prefetched methods, e.g. 'dad_joke'.
+        :return: The same dictionary the method returns.
+        """
+        item = self._take(endpoint)
+        if self._needs_refill(endpoint):
+            async with self._condition:
+                self._condition.notify_all()
+        if item is not None:
+            return item
+        item = await getattr(self.client, endpoint)()
+        self._remember(endpoint, self._key(item))
+        return item
+
+    async def close(self):
+        """
+        Stops the background refills; the client is left open.
+        """
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,223 @@
+"""
+Local stand-in for api.freejourney.xyz, for load testing and benchmarking the client without the real API.
+Every route of src/constants/endpoints.json is served with canned data shaped like the real responses.
+
+Usage example:
+    python mock_server.py --port 8080 --latency 0.05 --image-size 2000000 --error-rate 0.01 --throttle-rate 0.01
+
+    freejourney = Freejourney("<your_token_here>", base_url="http://127.0.0.1:8080/")
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import threading
+import time
+
+from index import load_endpoints
+
+TRIVIA = {'question': "Bogotá is the capital city of which country?",
+          'answers': {'correct': "Colombia", 'incorrect': ["Libya", "Eritrea", "El Salvador"]},
+          'difficulty': "medium"}
+
+class MockConfig:
+    """
+    Behaviour of the mock server; attributes may be changed while it is running.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, image_size=4096, image_sizes=None, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, completion="1 + 1 equals 2.", compress_responses=False,
+                 accept_compressed=True):
+        """
+        Creates an instance of MockConfig.
+        :param latency: Seconds to wait before answering each request.
+        :param jitter: Maximum random seconds added to the latency.
+        :param image_size: Size in bytes of the decoded images returned by image endpoints.
+        :param image_sizes: Per-endpoint image size overrides keyed by endpoint name, e.g. {'RemoveBackground': 4000000}.
+        :param error_rate: Probability of answering with HTTP 500.
+        :param throttle_rate: Probability of answering with HTTP 429 and a Retry-After header.
+        :param retry_after: The Retry-After value of throttled responses, in seconds.
+        :param completion: The completion text returned by chat endpoints.
+        :param compress_responses: Whether responses of at least 1 KB are gzipped for clients accepting it.
+        :param accept_compressed: Whether gzip request bodies are accepted, rather than answered with HTTP 415.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.image_size = image_size
+        self.image_sizes = image_sizes or {}
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.completion = completion
+        self.compress_responses = compress_responses
+        self.accept_compressed = accept_compressed
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering every Freejourney route.
+    :example:
+    # Usage example:
+    server = MockServer(('127.0.0.1', 0), MockConfig(latency=0.01))
+    server.start()
+    freejourney = Freejourney("<your_token_here>", base_url=server.url)
+    server.stop()
+    """
+    daemon_threads = True
+    # Queue enough connections for high-concurrency benchmarks.
+    request_queue_size = 1024
+
+    def __init__(self, address, config=None):
+        super().__init__(address, MockHandler)
+        self.config = config or MockConfig()
+        self.routes = {}
+        endpoints = load_endpoints()
+        for group, names in endpoints.items():
+            if isinstance(names, dict):
+                for name, path in names.items():
+                    self.routes['/' + path] = (group, name)
+        self._images = {}
+        self._images_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def image(self, size):
+        """
+        Returns the base64 text of a random image of the given decoded size, generated once per size.
+        """
+        with self._images_lock:
+            if size not in self._images:
+                self._images[size] = base64.b64encode(os.urandom(size)).decode('ascii')
+            return self._images[size]
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle's algorithm, keep-alive clients would wait for a delayed
+    # ACK on every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        encoding = self.headers.get('Content-Encoding', 'identity')
+        if encoding != 'identity':
+            if encoding != 'gzip' or not self.server.config.accept_compressed:
+                return self._send(415, {'success': False, 'message': f"Unsupported Content-Encoding: {encoding}."})
+            body = gzip.decompress(body)
+        try:
+            self._handle(json.loads(body) if body else {})
+        except ValueError:
+            self._send(400, {'success': False, 'message': "Invalid JSON body."})
+
+    def _handle(self, body):
+        config = self.server.config
+        route = self.server.routes.get(self.path.split('?')[0])
+        if route is None:
+            return self._send(404, {'success': False, 'message': "Not found."})
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        if config.throttle_rate and random.random() < config.throttle_rate:
+            return self._send(429, {'success': False, 'message': "Too many requests."},
+                              {'Retry-After': str(config.retry_after)})
+        if config.error_rate and random.random() < config.error_rate:
+            return self._send(500, {'success': False, 'message': "Internal server error."})
+        group, name = route
+        data = self._data(group, name, body)
+        if group == 'CHAT_COMPLETION' and 'text/event-stream' in self.headers.get('Accept', ''):
+            return self._stream(data['completion'])
+        self._send(200, {'success': True, 'data': data})
+
+    def _data(self, group, name, body):
+        config = self.server.config
+        if group == 'CHAT_COMPLETION':
+            data = {'prompt': body.get('prompt'), 'completion': config.completion}
+            if name == 'Characters':
+                data['model'] = {'model_id': body.get('model'), 'name': body.get('model')}
+            return data
+        if name == 'DadJoke':
+            return {'joke': "No matter how kind you are, German children are kinder."}
+        if name == 'Trivia':
+            return TRIVIA
+        if group in ('FUN', 'ANIMALS'):
+            return {'fact': f"A random {name} from the mock server."}
+        if name == 'TextFilter':
+            return {'text': body.get('text'), 'result': body.get('text')}
+        image = self.server.image(config.image_sizes.get(name, config.image_size))
+        if name in ('Midjourney', 'Nijijourney', 'DALLE', 'STABLE_DIFFUSION'):
+            images = ['data:image/png;base64,' + image] * (4 if body.get('number') == 4 else 1)
+            return {'base64': images if len(images) > 1 else images[0]}
+        return {'base64': image}
+
+    def _send(self, status, payload, headers=None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        if (self.server.config.compress_responses and len(content) >= 1024 and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            content = gzip.compress(content, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _stream(self, completion):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for word in completion.split(' '):
+            self._chunk(b'data: ' + json.dumps({'completion': word + ' '}).encode() + b'\n\n')
+        self._chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Freejourney API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before answering.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Maximum random seconds added to the latency.")
+    parser.add_argument('--image-size', type=int, default=4096, help="Decoded size of returned images, in bytes.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability of answering with HTTP 500.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Probability of answering with HTTP 429.")
+    parser.add_argument('--gzip', action='store_true', help="Gzip responses for clients accepting it.")
+    args = parser.parse_args()
+    config = MockConfig(latency=args.latency, jitter=args.jitter, image_size=args.image_size,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate, compress_responses=args.gzip)
+    server = MockServer((args.host, args.port), config)
+    print(f"Mock Freejourney API listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+Pipeline separating the I/O of Freejourney calls from the CPU-bound post-processing of their images.
+Calls run on a pool of threads sharing the client's pooled connections. Each returned image travels to a pool of
+worker processes through shared memory, as its base64 text, and the workers decode it and run the processing
+stages. No image is ever pickled, and the work spreads over every core instead of one thread holding the GIL.
+
+Stages are picklable callables (module-level functions or instances of module-level classes) receiving the bytes
+of the image and returning the next bytes. The last stage may instead return any other small value, such as the
+path it saved the image to; bytes are sent back through shared memory too.
+
+Usage example:
+    from pipeline import ImagePipeline, Reencode, verify_image
+
+    freejourney = Freejourney("<your_token_here>", pool_maxsize=16)
+    with ImagePipeline(freejourney, stages=[verify_image, Reencode('WEBP')], io_threads=16) as pipeline:
+        jobs = ((str(i), 'remove_background', [url]) for i, url in enumerate(urls))
+        for item in pipeline.run(jobs, ordered=False):
+            print(item.id, item.error or [len(output) for output in item.outputs])
+"""
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import shared_memory
+import binascii
+import io
+import multiprocessing
+
+from index import Image, Result
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+PipelineResult = namedtuple('PipelineResult', ['id', 'outputs', 'error'])
+PipelineResult.__doc__ = """
+One job of an ImagePipeline run.
+:param id: The id of the job.
+:param outputs: The output of the last stage for each image of the response, or None if the job failed.
+:param error: The exception raised by the call or a stage, or None if it succeeded.
+"""
+
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'GIF87a': 'image/gif',
+    b'GIF89a': 'image/gif',
+}
+
+def verify_image(data):
+    """
+    Stage checking that the data starts with a known image signature.
+    :raises ValueError: If it does not.
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return data
+    for signature in SIGNATURES:
+        if data[:len(signature)] == signature:
+            return data
+    raise ValueError("Not a PNG, JPEG, GIF or WEBP image")
+
+class Reencode:
+    """
+    Stage re-encoding the image with Pillow, e.g. to convert it or to optimize its size.
+    """
+    def __init__(self, format='PNG', **options):
+        """
+        Creates an instance of Reencode.
+        :param format: The Pillow format to encode to.
+        :param options: The options of Pillow's Image.save, e.g. optimize=True or quality=85.
+        """
+        if PILImage is None:
+            raise ImportError("Reencode requires the 'Pillow' package.")
+        self.format = format
+        self.options = options
+
+    def __call__(self, data):
+        output = io.BytesIO()
+        with PILImage.open(io.BytesIO(data)) as image:
+            image.save(output, self.format, **self.options)
+        return output.getbuffer()
+
+def _share(data):
+    """
+    Copies data into a new shared memory block, whose owner must eventually unlink it.
+    :return: The shared memory block.
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    memory.buf[:len(data)] = data
+    return memory
+
+def _take(name, size):
+    """
+    Copies out and frees a shared memory block created by a worker.
+    """
+    memory = shared_memory.SharedMemory(name)
+    try:
+        return bytes(memory.buf[:size])
+    finally:
+        memory.close()
+        memory.unlink()
+
+def _process(name, size, stages):
+    """
+    Worker process side: decodes the base64 text held in a shared memory block and runs the stages on the image.
+    :return: ('shared', name, size) for bytes-like outputs left in a new shared memory block, or ('value', output).
+    """
+    memory = shared_memory.SharedMemory(name)
+    try:
+        data = binascii.a2b_base64(memory.buf[:size])
+    finally:
+        memory.close()
+    for stage in stages:
+        data = stage(data)
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return 'value', data
+    output = _share(data)
+    output.close()
+    return 'shared', output.name, len(data)
+
+def _images(data, image=False):
+    """
+    Finds the base64 text of the images of a response, in order.
+    :param image: Whether data is the value of a base64 field, which may hold plain base64 text.
+    """
+    if isinstance(data, Image):
+        yield data.base64
+    elif isinstance(data, str):
+        if data.startswith('data:'):
+            yield data[data.index(',') + 1:]
+        elif image:
+            yield data
+    elif isinstance(data, Result):
+        yield from _images(data.to_dict())
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            yield from _images(value, key == 'base64')
+    elif isinstance(data, list):
+        for value in data:
+            yield from _images(value, image)
+
+class ImagePipeline:
+    """
+    Runs Freejourney calls on I/O threads and the processing of their images in worker processes.
+    Use it as a context manager, or call close() when done, to stop the pools.
+    :example:
+    # Usage example:
+    freejourney = Freejourney("<your_token_here>", pool_maxsize=8)
+    with ImagePipeline(freejourney, stages=[verify_image], io_threads=8) as pipeline:
+        for item in pipeline.run([('qr', 'create_qr_code', ["https://www.youtube.com/"])]):
+            print(item.id, len(item.outputs[0]))
+    # Output: qr 1034
+    """
+    def __init__(self, client, stages=(), processes=None, io_threads=8, mp_context=None):
+        """
+        Creates an instance of ImagePipeline.
+        :param client: The Freejourney instance to send requests with. Leave image_results off: with it, images
+                       are still re-encoded to base64 text in the I/O threads before being handed over.
+        :param stages: The picklable callables run on each image, in order.
+        :param processes: The number of worker processes; defaults to the number of CPUs.
+        :param io_threads: The maximum number of calls in flight at once; keep the client's pool_maxsize at least
+                           as large.
+        :param mp_context: The multiprocessing context of the workers. Defaults to 'forkserver' where available, as
+                           forking the workers while the I/O threads hold locks could deadlock them.
+        """
+        self.client = client
+        self.stages = tuple(stages)
+        self.io_threads = io_threads
+        self._io = ThreadPoolExecutor(max_workers=io_threads)
+        if mp_context is None and 'forkserver' in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context('forkserver')
+        self._workers = ProcessPoolExecutor(max_workers=processes, mp_context=mp_context)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._io.shutdown()
+        self._workers.shutdown()
+
+    def _job(self, job_id, endpoint, args):
+        """
+        I/O thread side: sends the call, hands its images to the workers and waits for them.
+        """
+        try:
+            method = getattr(self.client, endpoint)
+            result = method(**args) if isinstance(args, dict) else method(*args)
+            futures = []
+            for text in _images(result):
+                encoded = text.encode('ascii')
+                memory = _share(encoded)
+                future = self._workers.submit(_process, memory.name, len(encoded), self.stages)
+                futures.append((memory, future))
+            return PipelineResult(job_id, self._outputs(futures), None)
+        except Exception as err:
+            return PipelineResult(job_id, None, err)
+
+    @staticmethod
+    def _outputs(futures):
+        """
+        Waits for every image of a job, freeing all the shared memory blocks even when some stages fail.
+        :raises Exception: The first error raised by a stage, once every block has been freed.
+        """
+        outputs = []
+        error = None
+        for memory, future in futures:
+            try:
+                output = future.result()
+                outputs.append(_take(*output[1:]) if output[0] == 'shared' else output[1])
+            except Exception as err:
+                error = error or err
+            finally:
+                memory.close()
+                memory.unlink()
+        if error is not None:
+            raise error
+        return outputs
+
+    def run(self, jobs, ordered=True):
+        """
+        Runs jobs through the pipeline and yields their results as they complete.
+        Failed jobs are reported through PipelineResult.error instead of aborting the run.
+        :param jobs: An iterable of (id, endpoint, args) tuples, args being a list or a dictionary, as read by
+                     bulk_jobs.read_jobs; it is consumed lazily.
+        :param ordered: Whether to yield results in submission order rather than as they complete.
+        :return: A generator of PipelineResult.
+        """
+        window = self.io_threads * 2
+        pending = deque() if ordered else set()
+        submit = pending.append if ordered else pending.add
+        for job in jobs:
+            submit(self._io.submit(self._job, *job))
+            if len(pending) < window:
+                continue
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                submit = pending.add
+                for future in done:
+                    yield future.result()
+        if ordered:
+            while pending:
+                yield pending.popleft().result()
+        else:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()